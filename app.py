@@ -1,5 +1,7 @@
+import os
 import dash
 from dash import dcc, html, dash_table
+import numpy as np
 import pandas as pd
 from dash.dependencies import Input, Output
 from bot import TradingBot
@@ -10,8 +12,15 @@ from utils import (
     TIMEFRAME,
     LEVERAGE,
     RISK_BALANCE,
+    DASHBOARD_CACHE_SIZE,
+    CHART_POINTS,
+    TRADES_PAGE_SIZE,
+    backtest_results_file,
     load_backtest_results,
 )
+from cache import LRUCache
+from downsample import lttb
+from results import trades_frame
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 
@@ -23,6 +32,36 @@ bot = TradingBot(
     max_positions=1,
 )
 
+# Per symbol, rebuilt when the results file or the stored klines change
+results_cache = LRUCache(DASHBOARD_CACHE_SIZE)
+klines_cache = LRUCache(DASHBOARD_CACHE_SIZE)
+content_cache = LRUCache(DASHBOARD_CACHE_SIZE)
+markers_cache = LRUCache(DASHBOARD_CACHE_SIZE)
+price_cache = LRUCache(DASHBOARD_CACHE_SIZE)
+trades_cache = LRUCache(DASHBOARD_CACHE_SIZE)
+
+# DataTable filter operators, longest first so "ge" is not read as "gt"
+FILTER_OPERATORS = [
+    ("ge ", ">="),
+    ("le ", "<="),
+    ("lt ", "<"),
+    ("gt ", ">"),
+    ("ne ", "!="),
+    ("eq ", "="),
+    ("contains ",),
+    ("datestartswith ",),
+]
+
+PLOT_COLUMNS = [
+    "Close",
+    "ema_200",
+    "macd",
+    "macd_signal",
+    "macd_diff",
+    "stoch_rsi_k",
+    "stoch_rsi_d",
+]
+
 # Initialize the Dash app
 app = dash.Dash(__name__)
 
@@ -68,9 +107,19 @@ app.layout = html.Div(
                     id="balance-line-chart",
                     style={"margin-bottom": "20px"},
                 ),
-                html.Div(
+                # Only the visible page is sent, sorted and filtered on the server
+                dash_table.DataTable(
                     id="trades-table",
-                    style={"margin-bottom": "20px"},
+                    page_action="custom",
+                    page_current=0,
+                    page_size=TRADES_PAGE_SIZE,
+                    sort_action="custom",
+                    sort_mode="multi",
+                    sort_by=[],
+                    filter_action="custom",
+                    filter_query="",
+                    style_table={"overflowX": "auto", "margin-bottom": "20px"},
+                    style_cell={"textAlign": "left"},
                 ),
             ],
         ),
@@ -82,23 +131,31 @@ app.layout = html.Div(
 @app.callback(
     [
         Output("metrics-table", "children"),
-        Output("trades-table", "children"),
         Output("pnl-bar-chart", "figure"),
-        Output("price-line-chart", "figure"),
         Output("balance-line-chart", "figure"),
     ],
     [Input("symbol-dropdown", "value")],
 )
 def update_content(selected_symbol: str):
-    # Instantiate TradingBot and fetch klines with indicators
-    backtest_results = load_backtest_results(selected_symbol)
-    kl = bot.fetch_kline(selected_symbol, TIMEFRAME)
+    results_version = os.path.getmtime(backtest_results_file(selected_symbol))
+    return content_cache.get(
+        selected_symbol,
+        results_version,
+        lambda: build_content(
+            results_cache.get(
+                selected_symbol,
+                results_version,
+                lambda: load_backtest_results(selected_symbol),
+            ),
+        ),
+    )
 
-    if len(backtest_results["trades"]) > 0:
+
+def build_content(backtest_results):
+    if len(backtest_results["trades"]["pnl"]) > 0:
         # Filter results for the selected symbol
         metrics_df = pd.DataFrame([backtest_results["metrics"]])
-        trades_df = pd.DataFrame(backtest_results["trades"])
-        del trades_df["open"]
+        trades_df = trades_frame(backtest_results["trades"])
 
         # Transpose the DataFrame to make it vertical
         metrics_df_vertical = metrics_df.T.reset_index()
@@ -112,13 +169,6 @@ def update_content(selected_symbol: str):
             style_cell={"textAlign": "left"},
         )
 
-        trades_table = dash_table.DataTable(
-            data=trades_df.to_dict("records"),
-            columns=[{"name": i, "id": i} for i in trades_df.columns],
-            style_table={"overflowX": "auto"},
-            style_cell={"textAlign": "left"},
-        )
-
         # Create a bar chart for PnL
         pnl_fig = {
             "data": [
@@ -128,9 +178,7 @@ def update_content(selected_symbol: str):
                     "type": "bar",
                     "name": "PnL",
                     "marker": {
-                        "color": trades_df["pnl"].apply(
-                            lambda x: "red" if x < 0 else "green"
-                        )
+                        "color": np.where(trades_df["pnl"] < 0, "red", "green")
                     },
                 },
             ],
@@ -141,195 +189,6 @@ def update_content(selected_symbol: str):
             },
         }
 
-        # Create a subplot figure with 2 rows, setting the row heights
-        fig = make_subplots(
-            rows=3,
-            cols=1,
-            shared_xaxes=True,
-            vertical_spacing=0.1,
-            subplot_titles=("Close Price", "MACD", "Stoch RSI"),
-            row_heights=[
-                0.7,
-                0.3,
-                0.3,
-            ],  # 70% for the first row, 30% for the second row
-        )
-
-        # Use only the last 1000 rows for plotting
-        plot_kl = kl.tail(1000)
-
-        # Match entry prices from trades_df to klines dataframe
-        plot_kl = plot_kl.copy()
-        plot_kl["buy_entry_price"] = None
-        plot_kl["sell_entry_price"] = None
-        plot_kl["buy_exit_price"] = None
-        plot_kl["sell_exit_price"] = None
-
-        # Add entry prices
-        for date, price, sign in zip(
-            trades_df["entry_date"], trades_df["entry_price"], trades_df["sign"]
-        ):
-            if date in plot_kl.index:
-                plot_kl.loc[date, f"{sign}_entry_price"] = price
-
-        # Add exit prices
-        for date, price, sign in zip(
-            trades_df["exit_date"], trades_df["exit_price"], trades_df["sign"]
-        ):
-            if date in plot_kl.index:
-                plot_kl.loc[date, f"{sign}_exit_price"] = price
-
-        # Add Close Price and EMA 200 to the first row
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["Close"],
-                mode="lines",
-                name="Close Price",
-                hovertemplate="Date: %{x}<br>Close Price: %{y}<extra></extra>",
-            ),
-            row=1,
-            col=1,
-        )
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["ema_200"],
-                mode="lines",
-                name="EMA 200",
-                line=dict(dash="dash", color="blue"),
-                hovertemplate="Date: %{x}<br>EMA 200: %{y}<extra></extra>",
-            ),
-            row=1,
-            col=1,
-        )
-
-        # Add trade markers to the first row
-        # Add buy signals
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["buy_entry_price"],
-                mode="markers",
-                name="Open Long",
-                marker=dict(color="green", size=10, symbol="triangle-up"),
-                hovertemplate="Date: %{x}<br>Open Long: %{y}<extra></extra>",
-            ),
-            row=1,
-            col=1,
-        )
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["buy_exit_price"],
-                mode="markers",
-                name="Close Long",
-                marker=dict(color="green", size=10, symbol="triangle-down"),
-                hovertemplate="Date: %{x}<br>Exit Long: %{y}<extra></extra>",
-            ),
-            row=1,
-            col=1,
-        )
-
-        # Add sell signals
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["sell_entry_price"],
-                mode="markers",
-                name="Open Short",
-                marker=dict(color="red", size=10, symbol="triangle-down"),
-                hovertemplate="Date: %{x}<br>Open Short: %{y}<extra></extra>",
-            ),
-            row=1,
-            col=1,
-        )
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["sell_exit_price"],
-                mode="markers",
-                name="Close Short",
-                marker=dict(color="red", size=10, symbol="triangle-up"),
-                hovertemplate="Date: %{x}<br>Exit Short: %{y}<extra></extra>",
-            ),
-            row=1,
-            col=1,
-        )
-        # Add second row
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["macd"],
-                mode="lines",
-                name="MACD",
-                line=dict(color="orange"),
-                hovertemplate="Date: %{x}<br>MACD: %{y}<extra></extra>",
-            ),
-            row=2,
-            col=1,
-        )
-
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["macd_signal"],
-                mode="lines",
-                name="MACD Signal",
-                line=dict(color="blue"),
-                hovertemplate="Date: %{x}<br>MACD Signal: %{y}<extra></extra>",
-            ),
-            row=2,
-            col=1,
-        )
-
-        fig.add_trace(
-            go.Bar(
-                x=plot_kl.index,
-                y=plot_kl["macd_diff"],
-                name="MACD Hist",
-                marker=dict(
-                    color=[
-                        "red" if val < 0 else "green" for val in plot_kl["macd_diff"]
-                    ]
-                ),
-            ),
-            row=2,
-            col=1,
-        )
-
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["stoch_rsi_k"],
-                name="Stoch RSI K",
-                line=dict(color="orange"),
-            ),
-            row=3,
-            col=1,
-        )
-
-        fig.add_trace(
-            go.Scatter(
-                x=plot_kl.index,
-                y=plot_kl["stoch_rsi_d"],
-                name="Stoch RSI D",
-                line=dict(color="blue"),
-            ),
-            row=3,
-            col=1,
-        )
-
-        # Update layout
-        fig.update_layout(
-            height=700,
-            title_text="Close Price",
-            xaxis_title="Date",
-            yaxis_title="Price",
-            yaxis2_title="RSI",
-            hovermode="x unified",  # Show all hover data for the same x value
-        )
-
         # Create a line chart for Final Balance
         balance_fig = {
             "data": [
@@ -348,9 +207,329 @@ def update_content(selected_symbol: str):
             },
         }
 
-        return metrics_table, trades_table, pnl_fig, fig, balance_fig
+        return metrics_table, pnl_fig, balance_fig
     else:
-        return None, None, None, None, None
+        return None, None, None
+
+
+@app.callback(
+    [
+        Output("trades-table", "data"),
+        Output("trades-table", "columns"),
+        Output("trades-table", "page_count"),
+    ],
+    [
+        Input("symbol-dropdown", "value"),
+        Input("trades-table", "page_current"),
+        Input("trades-table", "page_size"),
+        Input("trades-table", "sort_by"),
+        Input("trades-table", "filter_query"),
+    ],
+)
+def update_trades_table(
+    selected_symbol, page_current, page_size, sort_by, filter_query
+):
+    results_version = os.path.getmtime(backtest_results_file(selected_symbol))
+    trades_df = trades_cache.get(
+        selected_symbol,
+        results_version,
+        lambda: trades_frame(
+            results_cache.get(
+                selected_symbol,
+                results_version,
+                lambda: load_backtest_results(selected_symbol),
+            )["trades"]
+        ),
+    )
+    columns = [{"name": i, "id": i} for i in trades_df.columns]
+
+    trades_df = filter_trades(trades_df, filter_query)
+    if sort_by:
+        trades_df = trades_df.sort_values(
+            [col["column_id"] for col in sort_by],
+            ascending=[col["direction"] == "asc" for col in sort_by],
+            inplace=False,
+        )
+
+    # Clamp the page, a new symbol or filter can have fewer pages
+    page_count = max(1, -(-len(trades_df) // page_size))
+    page = min(page_current or 0, page_count - 1)
+    rows = trades_df.iloc[page * page_size: (page + 1) * page_size].copy()
+    for name in ("entry_date", "exit_date"):
+        dates = iso_dates(rows[name]).astype(object)
+        rows[name] = dates.where(rows[name].notna(), None)
+    return rows.to_dict("records"), columns, page_count
+
+
+def split_filter_part(filter_part):
+    # "{pnl} ge 10" or "{pnl} >= 10" -> ("pnl", "ge", 10.0)
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator not in filter_part:
+                continue
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+            value_part = value_part.strip()
+            quote = value_part[:1]
+            if quote and quote in "'\"`" and value_part[-1] == quote:
+                value = value_part[1:-1].replace("\\" + quote, quote)
+            elif len(operator_type) == 1:
+                # "contains" and "datestartswith" match text
+                value = value_part
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def filter_trades(trades_df, filter_query):
+    for filter_part in (filter_query or "").split(" && "):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in trades_df:
+            continue
+        column = trades_df[col_name]
+        is_date = pd.api.types.is_datetime64_dtype(column)
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            if is_date:
+                try:
+                    filter_value = pd.Timestamp(str(filter_value))
+                except ValueError:
+                    continue
+            elif isinstance(filter_value, str) and column.dtype != object:
+                continue
+            mask = getattr(column, operator)(filter_value)
+        else:
+            # Text operators match dates as shown in the table
+            text = iso_dates(column) if is_date else column.astype(str)
+            if operator == "contains":
+                mask = text.str.contains(filter_value, regex=False, na=False)
+            else:
+                mask = text.str.startswith(filter_value, na=False)
+        trades_df = trades_df.loc[mask]
+    return trades_df
+
+
+def iso_dates(column):
+    return column.dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+@app.callback(
+    Output("price-line-chart", "figure"),
+    [Input("symbol-dropdown", "value"), Input("price-line-chart", "relayoutData")],
+)
+def update_price_chart(selected_symbol: str, relayout_data):
+    results_version = os.path.getmtime(backtest_results_file(selected_symbol))
+    klines_version = bot.store.mtime(selected_symbol, TIMEFRAME)
+    kl = klines_cache.get(
+        selected_symbol,
+        klines_version,
+        lambda: bot.load_columns(selected_symbol, TIMEFRAME, PLOT_COLUMNS),
+    )
+    markers = markers_cache.get(
+        selected_symbol,
+        results_version,
+        lambda: trade_markers(load_backtest_results(selected_symbol)),
+    )
+
+    # Zooming only resamples the visible range; a new symbol, a double
+    # click or the first load draw the whole history (cached)
+    start, end = None, None
+    if dash.callback_context.triggered_id == "price-line-chart":
+        start, end = zoom_range(relayout_data)
+    if start is None:
+        return price_cache.get(
+            selected_symbol,
+            (results_version, klines_version),
+            lambda: build_price_figure(selected_symbol, kl, markers),
+        )
+    return build_price_figure(selected_symbol, kl, markers, start, end)
+
+
+def zoom_range(relayout_data):
+    # Any of the shared x axes: {"xaxis2.range[0]": ..., "xaxis2.range[1]": ...}
+    # or {"xaxis.range": [start, end]}
+    for key, value in (relayout_data or {}).items():
+        if key.startswith("xaxis") and key.endswith(".range[0]"):
+            end = relayout_data.get(key.replace("[0]", "[1]"))
+            return pd.Timestamp(value), pd.Timestamp(end)
+        if key.startswith("xaxis") and key.endswith(".range"):
+            return pd.Timestamp(value[0]), pd.Timestamp(value[1])
+    return None, None
+
+
+def trade_markers(backtest_results):
+    # Entry and exit points of every trade, one frame per marker trace
+    trades = trades_frame(backtest_results["trades"])
+    entries = pd.DataFrame(
+        {
+            "date": trades["entry_date"],
+            "price": trades["entry_price"],
+            "trace": trades["sign"] + "_entry",
+        }
+    )
+    exits = pd.DataFrame(
+        {
+            "date": trades["exit_date"],
+            "price": trades["exit_price"],
+            "trace": trades["sign"] + "_exit",
+        }
+    )
+    markers = pd.concat([entries, exits]).dropna(subset=["date"])
+    return {
+        trace: group.sort_values("date")
+        for trace, group in markers.groupby("trace")
+    }
+
+
+def build_price_figure(symbol, kl, markers, start=None, end=None):
+    # Full history (or the zoomed range) reduced to CHART_POINTS candles
+    if start is not None:
+        kl = kl[(kl.index >= start) & (kl.index <= end)]
+    times = kl.index.values.astype("datetime64[ns]").view(np.int64)
+    plot_kl = kl.iloc[lttb(times, kl["Close"].to_numpy(), CHART_POINTS)]
+
+    # Create a subplot figure with 2 rows, setting the row heights
+    fig = make_subplots(
+        rows=3,
+        cols=1,
+        shared_xaxes=True,
+        vertical_spacing=0.1,
+        subplot_titles=("Close Price", "MACD", "Stoch RSI"),
+        row_heights=[
+            0.7,
+            0.3,
+            0.3,
+        ],  # 70% for the first row, 30% for the second row
+    )
+
+    # Add Close Price and EMA 200 to the first row
+    fig.add_trace(
+        go.Scatter(
+            x=plot_kl.index,
+            y=plot_kl["Close"],
+            mode="lines",
+            name="Close Price",
+            hovertemplate="Date: %{x}<br>Close Price: %{y}<extra></extra>",
+        ),
+        row=1,
+        col=1,
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=plot_kl.index,
+            y=plot_kl["ema_200"],
+            mode="lines",
+            name="EMA 200",
+            line=dict(dash="dash", color="blue"),
+            hovertemplate="Date: %{x}<br>EMA 200: %{y}<extra></extra>",
+        ),
+        row=1,
+        col=1,
+    )
+
+    # Add trade markers to the first row, every trade in range is drawn
+    # even when its candle was dropped by the downsampling
+    for trace, name, color, marker_symbol in (
+        ("buy_entry", "Open Long", "green", "triangle-up"),
+        ("buy_exit", "Close Long", "green", "triangle-down"),
+        ("sell_entry", "Open Short", "red", "triangle-down"),
+        ("sell_exit", "Close Short", "red", "triangle-up"),
+    ):
+        points = markers.get(trace)
+        if points is None:
+            continue
+        # Only trades on a stored candle of the plotted range
+        points = points[points["date"].isin(kl.index)]
+        fig.add_trace(
+            go.Scatter(
+                x=points["date"],
+                y=points["price"],
+                mode="markers",
+                name=name,
+                marker=dict(color=color, size=10, symbol=marker_symbol),
+                hovertemplate=f"Date: %{{x}}<br>{name}: %{{y}}<extra></extra>",
+            ),
+            row=1,
+            col=1,
+        )
+
+    # Add second row
+    fig.add_trace(
+        go.Scatter(
+            x=plot_kl.index,
+            y=plot_kl["macd"],
+            mode="lines",
+            name="MACD",
+            line=dict(color="orange"),
+            hovertemplate="Date: %{x}<br>MACD: %{y}<extra></extra>",
+        ),
+        row=2,
+        col=1,
+    )
+
+    fig.add_trace(
+        go.Scatter(
+            x=plot_kl.index,
+            y=plot_kl["macd_signal"],
+            mode="lines",
+            name="MACD Signal",
+            line=dict(color="blue"),
+            hovertemplate="Date: %{x}<br>MACD Signal: %{y}<extra></extra>",
+        ),
+        row=2,
+        col=1,
+    )
+
+    fig.add_trace(
+        go.Bar(
+            x=plot_kl.index,
+            y=plot_kl["macd_diff"],
+            name="MACD Hist",
+            marker=dict(color=np.where(plot_kl["macd_diff"] < 0, "red", "green")),
+        ),
+        row=2,
+        col=1,
+    )
+
+    fig.add_trace(
+        go.Scatter(
+            x=plot_kl.index,
+            y=plot_kl["stoch_rsi_k"],
+            name="Stoch RSI K",
+            line=dict(color="orange"),
+        ),
+        row=3,
+        col=1,
+    )
+
+    fig.add_trace(
+        go.Scatter(
+            x=plot_kl.index,
+            y=plot_kl["stoch_rsi_d"],
+            name="Stoch RSI D",
+            line=dict(color="blue"),
+        ),
+        row=3,
+        col=1,
+    )
+
+    # Update layout
+    fig.update_layout(
+        height=700,
+        title_text="Close Price",
+        xaxis_title="Date",
+        yaxis_title="Price",
+        yaxis2_title="RSI",
+        hovermode="x unified",  # Show all hover data for the same x value
+        # Keep the user's zoom when the resampled figure comes back
+        uirevision=symbol,
+    )
+    if start is not None:
+        fig.update_xaxes(range=[start, end])
+    return fig
 
 
 # Run the app
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+NAT = np.iinfo(np.int64).min
+
+TRADE_COLUMNS = {
+    "entry_idx": np.int64,
+    "exit_idx": np.int64,
+    "entry_time": np.int64,
+    "exit_time": np.int64,
+    "entry_price": np.float64,
+    "exit_price": np.float64,
+    "qty": np.float64,
+    "side": np.int8,
+    "tp_price": np.float64,
+    "sl_price": np.float64,
+    "lended_qty": np.float64,
+    "pnl": np.float64,
+    "starting_balance": np.float64,
+    "final_balance": np.float64,
+    "open": np.bool_,
+}
+
+# First row the backtest looks at, the old loop started at iloc[:3]
+START_ROW = 2
+
+
+def encode_signals(signals):
+    # buy -> 1, sell -> -1, anything else (hold, warmup None) -> 0
+    signals = np.asarray(signals, dtype=object)
+    return np.select(
+        [signals == "buy", signals == "sell"], [1, -1], 0
+    ).astype(np.int8)
+
+
+def frame_arrays(kl):
+    close = kl.Close.to_numpy(dtype=np.float64)
+    side = encode_signals(kl["signal"].to_numpy())
+    times = kl.index.values.astype("datetime64[ns]").view(np.int64)
+    return close, side, times
+
+
+def find_exit(close, start, stop, side, tp_price, sl_price):
+    # Scan in growing chunks so a trade only costs its own length
+    chunk = 64
+    while start < stop:
+        window = close[start: min(start + chunk, stop)]
+        if side == 1:
+            hit = (window >= tp_price) | (window <= sl_price)
+        else:
+            hit = (window <= tp_price) | (window >= sl_price)
+        j = hit.argmax()
+        if hit[j]:
+            return start + j
+        start += len(window)
+        chunk *= 2
+    return -1
+
+
+def exit_levels(sign, entry_price, tp, sl):
+    # (tp_price, sl_price) of a trade opened at entry_price
+    if sign == 1:
+        return entry_price * (1 + tp), entry_price * (1 - sl)
+    return entry_price * (1 - tp), entry_price * (1 + sl)
+
+
+def run_backtest(
+    close, side, times, tp, sl, balance, leverage, risk_balance, exits=None
+):
+    # exits: an exits.ExitResolver to check TP/SL against High/Low, else
+    # only Close is checked
+    n = len(close)
+    # The last candle is only used to mark a still open trade
+    last = n - 1
+    columns = {name: [] for name in TRADE_COLUMNS}
+    entries = np.flatnonzero(side[:last] != 0)
+    entries = entries[entries >= START_ROW]
+
+    updated_balance = balance
+    i = START_ROW
+    while True:
+        k = entries.searchsorted(i)
+        if k == len(entries):
+            break
+        entry = entries[k]
+        sign = side[entry]
+        entry_price = close[entry]
+        starting_balance = updated_balance
+        qty = updated_balance * leverage * risk_balance
+        lended_qty = qty / entry_price
+        tp_price, sl_price = exit_levels(sign, entry_price, tp, sl)
+        updated_balance -= starting_balance * risk_balance
+
+        if exits is None:
+            exit_idx = find_exit(close, entry + 1, last, sign, tp_price, sl_price)
+            exit_price = close[exit_idx]
+        else:
+            exit_idx, exit_price = exits.find(
+                entry + 1, last, sign, tp_price, sl_price
+            )
+        is_open = exit_idx == -1
+        if is_open:
+            exit_price = close[last]
+        if sign == 1:
+            pnl = (exit_price - entry_price) * lended_qty
+        else:
+            pnl = (entry_price - exit_price) * lended_qty
+
+        if is_open:
+            starting_balance = updated_balance
+            updated_balance = updated_balance + pnl
+        else:
+            updated_balance = starting_balance + pnl
+
+        columns["entry_idx"].append(entry)
+        columns["exit_idx"].append(exit_idx)
+        columns["entry_time"].append(times[entry])
+        columns["exit_time"].append(NAT if is_open else times[exit_idx])
+        columns["entry_price"].append(entry_price)
+        columns["exit_price"].append(exit_price)
+        columns["qty"].append(qty)
+        columns["side"].append(sign)
+        columns["tp_price"].append(tp_price)
+        columns["sl_price"].append(sl_price)
+        columns["lended_qty"].append(lended_qty)
+        columns["pnl"].append(pnl)
+        columns["starting_balance"].append(starting_balance)
+        columns["final_balance"].append(updated_balance)
+        columns["open"].append(is_open)
+
+        if is_open:
+            break
+        i = exit_idx + 1
+
+    return {
+        name: np.asarray(values, dtype=TRADE_COLUMNS[name])
+        for name, values in columns.items()
+    }
+
+
+def trades_to_records(trades):
+    columns = {name: values.tolist() for name, values in trades.items()}
+    entry_dates = list(pd.to_datetime(trades["entry_time"]))
+    exit_dates = list(pd.to_datetime(trades["exit_time"]))
+    records = []
+    for i in range(len(entry_dates)):
+        records.append(
+            {
+                "entry_date": entry_dates[i],
+                "exit_date": None if columns["open"][i] else exit_dates[i],
+                "entry_price": columns["entry_price"][i],
+                "exit_price": columns["exit_price"][i],
+                "qty": columns["qty"][i],
+                "sign": "buy" if columns["side"][i] == 1 else "sell",
+                "open": columns["open"][i],
+                "tp_price": columns["tp_price"][i],
+                "sl_price": columns["sl_price"][i],
+                "starting_balance": columns["starting_balance"][i],
+                "lended_qty": columns["lended_qty"][i],
+                "pnl": columns["pnl"][i],
+                "final_balance": columns["final_balance"][i],
+            }
+        )
+    return records
+
+
+def iso_dates(records):
+    # Trade records with their dates as ISO strings, for json.dump
+    for trade in records:
+        for key in ("entry_date", "exit_date"):
+            if isinstance(trade.get(key), pd.Timestamp):
+                trade[key] = trade[key].isoformat()
+    return records
@@ -1,103 +1,171 @@
 from binance.client import Client
 import pandas as pd
-from time import sleep
-from binance.error import ClientError
+from time import time, perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from binance.exceptions import BinanceAPIException
+from rate_limit import (
+    RequestScheduler,
+    PRIORITY_ORDER,
+    PRIORITY_ACCOUNT,
+    PRIORITY_MARKET,
+)
+
+# Seconds before the cached exchange info is downloaded again
+EXCHANGE_INFO_TTL = 60 * 60
+
+# Request weight of each client call (Binance Futures API docs)
+WEIGHTS = {
+    "futures_account_balance": 5,
+    "futures_position_risk": 5,
+    "futures_get_orders": 40,
+    "futures_cancel_open_orders": 1,
+    "futures_ticker_price": 2,
+    "futures_income_history": 30,
+    "futures_klines": 5,
+    "futures_historical_klines": 5,
+    "futures_change_leverage": 1,
+    "futures_change_margin_type": 1,
+    "futures_exchange_info": 1,
+    "futures_commission_rate": 20,
+    "futures_place_batch_order": 5,
+    "futures_new_order": 1,
+}
+
+
+def print_api_error(error):
+    # python-binance errors (BinanceAPIException)
+    print(
+        f"Found error. status: {error.status_code}, error code: {error.code}, "
+        f"error message: {error.message}"
+    )
 
 
 class Binance:
-    def __init__(self, api, secret):
+    def __init__(self, api, secret, batch_orders=True):
         self.api = api
         self.secret = secret
-        self.client = Client(api, secret)
+        self._client = None
+        self.symbols_info = dict()
+        self.symbols_info_time = 0
+        self.leverages = dict()
+        self.modes = dict()
+        # Milliseconds from sending the entry to having SL/TP in place
+        self.order_latencies = list()
+        self.scheduler = RequestScheduler()
+        # Entry, SL and TP in one batchOrders request, see place_orders
+        self.batch_orders = batch_orders
+
+    @property
+    def client(self):
+        # Created on first use so offline work (backtests, dashboard) does
+        # not need to reach the exchange
+        if self._client is None:
+            self._client = Client(self.api, self.secret)
+            self.scheduler.mount(self._client.session)
+        return self._client
+
+    def call(self, name, priority, *args, **kwargs):
+        return self.scheduler.run(
+            name,
+            priority,
+            WEIGHTS.get(name, 1),
+            getattr(self.client, name),
+            *args,
+            **kwargs,
+        )
 
     def get_balance_usdt(self):
         try:
-            response = self.client.futures_account_balance(recvWindow=10000)
+            response = self.call(
+                "futures_account_balance", PRIORITY_ACCOUNT, recvWindow=10000
+            )
             for elem in response:
                 if elem["asset"] == "USDT":
                     return float(elem["balance"])
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def get_positions(self):
         try:
-            resp = self.client.futures_position_risk(recvWindow=10000)
+            resp = self.call(
+                "futures_position_risk", PRIORITY_ACCOUNT, recvWindow=10000
+            )
             pos = []
             for elem in resp:
                 if float(elem["positionAmt"]) != 0:
                     pos.append(elem)
             return pos
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def check_orders(self):
         try:
-            response = self.client.futures_get_orders(recvWindow=10000)
+            response = self.call(
+                "futures_get_orders", PRIORITY_ACCOUNT, recvWindow=10000
+            )
             sym = []
             for elem in response:
                 sym.append(elem["symbol"])
             return sym
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def close_open_orders(self, symbol):
         try:
-            response = self.client.futures_cancel_open_orders(
-                symbol=symbol, recvWindow=10000
+            response = self.call(
+                "futures_cancel_open_orders",
+                PRIORITY_ORDER,
+                symbol=symbol,
+                recvWindow=10000,
             )
             print("Orders Closed")
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def get_ticker_usdt(self, symbol: str):
         try:
-            resp = self.client.futures_ticker_price(symbol=symbol)
+            resp = self.call("futures_ticker_price", PRIORITY_MARKET, symbol=symbol)
             return float(resp["price"])
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def get_tickers_usdt(self):
         try:
             tickers = []
-            resp = self.client.futures_ticker_price()
+            resp = self.call("futures_ticker_price", PRIORITY_MARKET)
             for elem in resp:
                 if "USDT" in elem["symbol"]:
                     tickers.append(elem)
             return tickers
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def get_pnl(self, limit):
         try:
-            resp = self.client.futures_income_history(
-                incomeType="REALIZED_PNL", limit=limit, recvWindow=10000
+            resp = self.call(
+                "futures_income_history",
+                PRIORITY_ACCOUNT,
+                incomeType="REALIZED_PNL",
+                limit=limit,
+                recvWindow=10000,
             )[::-1]
             pnl = 0
             for elem in resp:
                 pnl += float(elem["income"])
             return pnl
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def klines(self, symbol, timeframe):
         try:
             resp = pd.DataFrame(
-                self.client.futures_klines(
-                    symbol, timeframe, recvWindow=10000, limit=1000
+                self.call(
+                    "futures_klines",
+                    PRIORITY_MARKET,
+                    symbol=symbol,
+                    interval=timeframe,
+                    recvWindow=10000,
+                    limit=1000,
                 )
             )
             resp = resp.iloc[:, :6]
@@ -106,146 +174,233 @@ class Binance:
             resp.index = pd.to_datetime(resp.index, unit="ms")
             resp = resp.astype(float)
             return resp
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def get_historical_klines(self, symbol, timeframe, start_date, end_date):
         try:
-            resp = self.client.futures_historical_klines(
+            resp = self.call(
+                "futures_historical_klines",
+                PRIORITY_MARKET,
                 symbol,
                 timeframe,
                 start_date,
                 end_date,
             )
             return resp
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def set_leverage(self, symbol, level):
+        # Skip the call when the last change we made is still in place
+        if self.leverages.get(symbol) == level:
+            return
         try:
-            response = self.client.futures_change_leverage(
-                symbol=symbol, leverage=level, recvWindow=10000
-            )
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
+            response = self.call(
+                "futures_change_leverage",
+                PRIORITY_ORDER,
+                symbol=symbol,
+                leverage=level,
+                recvWindow=10000,
             )
+            self.leverages[symbol] = level
+        except BinanceAPIException as error:
+            print_api_error(error)
 
     def set_mode(self, symbol, type):
+        if self.modes.get(symbol) == type:
+            return
         try:
-            response = self.client.futures_change_margin_type(
-                symbol=symbol, marginType=type, recvWindow=10000
-            )
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
+            response = self.call(
+                "futures_change_margin_type",
+                PRIORITY_ORDER,
+                symbol=symbol,
+                marginType=type,
+                recvWindow=10000,
             )
+            self.modes[symbol] = type
+        except BinanceAPIException as error:
+            # -4046: "No need to change margin type", already in that mode
+            if error.code == -4046:
+                self.modes[symbol] = type
+                return
+            print_api_error(error)
+
+    def get_symbol_info(self, symbol):
+        # futures_exchange_info is a heavy call with every symbol in it, keep
+        # it indexed by symbol and refresh it every EXCHANGE_INFO_TTL seconds
+        if (
+            symbol not in self.symbols_info
+            or time() - self.symbols_info_time > EXCHANGE_INFO_TTL
+        ):
+            try:
+                resp = self.call("futures_exchange_info", PRIORITY_MARKET)["symbols"]
+                self.symbols_info = {elem["symbol"]: elem for elem in resp}
+                self.symbols_info_time = time()
+            except BinanceAPIException as error:
+                print_api_error(error)
+        return self.symbols_info.get(symbol)
+
+    def get_filters(self, symbol):
+        info = self.get_symbol_info(symbol)
+        if info is None:
+            return None
+        return {elem["filterType"]: elem for elem in info["filters"]}
 
     def get_precisions(self, symbol):
-        try:
-            resp = self.client.futures_exchange_info()["symbols"]
-            for elem in resp:
-                if elem["symbol"] == symbol:
-                    return elem["pricePrecision"], elem["quantityPrecision"]
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-            )
+        info = self.get_symbol_info(symbol)
+        if info is not None:
+            return info["pricePrecision"], info["quantityPrecision"]
 
     def get_commission(self, symbol):
         try:
-            resp = self.client.futures_commission_rate(symbol=symbol, recvWindow=10000)
+            resp = self.call(
+                "futures_commission_rate",
+                PRIORITY_ACCOUNT,
+                symbol=symbol,
+                recvWindow=10000,
+            )
             return float(resp["makerCommissionRate"]), float(
                 resp["takerCommissionRate"]
             )
-        except ClientError as error:
-            print(
-                f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
+        except BinanceAPIException as error:
+            print_api_error(error)
+
+    def entry_orders(self, symbol, side, qty, sl_price, tp_price):
+        close_side = "SELL" if side == "buy" else "BUY"
+        entry = {
+            "symbol": symbol,
+            "side": "BUY" if side == "buy" else "SELL",
+            "type": "MARKET",
+            "quantity": qty,
+        }
+        stop_loss = {
+            "symbol": symbol,
+            "side": close_side,
+            "type": "STOP_MARKET",
+            "stopPrice": sl_price,
+            "closePosition": "true",
+            "workingType": "MARK_PRICE",
+        }
+        take_profit = {
+            "symbol": symbol,
+            "side": close_side,
+            "type": "TAKE_PROFIT_MARKET",
+            "stopPrice": tp_price,
+            "closePosition": "true",
+            "workingType": "MARK_PRICE",
+        }
+        return [entry, stop_loss, take_profit]
+
+    def place_orders(self, orders):
+        # One batchOrders round trip, or the three orders sent at the same
+        # time when batch_orders is off or the batch request is rejected as
+        # a whole (then nothing was placed). Failed legs come back as
+        # {"code": ..., "msg": ...} like in the batch response.
+        if self.batch_orders:
+            try:
+                # No recvWindow: python-binance encodes batchOrders as if it
+                # were the only parameter, anything else ends up twice in
+                # the signed body and the request is rejected
+                return self.call(
+                    "futures_place_batch_order", PRIORITY_ORDER, batchOrders=orders
+                )
+            except BinanceAPIException as error:
+                print_api_error(error)
+                print("Batch order rejected, sending the orders one by one")
+
+        def send(order):
+            try:
+                return self.call(
+                    "futures_new_order", PRIORITY_ORDER, **order, recvWindow=10000
+                )
+            except BinanceAPIException as error:
+                return {"code": error.code, "msg": error.message}
+
+        with ThreadPoolExecutor(max_workers=len(orders)) as executor:
+            return list(executor.map(send, orders))
+
+    def rollback_entry(self, symbol, side, qty):
+        # Protective legs failed: flatten first, then cancel whatever was
+        # placed, so a failed cancel does not leave the position open
+        print(f"Protective orders failed on {symbol}, closing position")
+        try:
+            self.call(
+                "futures_new_order",
+                PRIORITY_ORDER,
+                symbol=symbol,
+                side="SELL" if side == "buy" else "BUY",
+                type="MARKET",
+                quantity=qty,
+                reduceOnly="true",
+                recvWindow=10000,
             )
+        except BinanceAPIException as error:
+            print_api_error(error)
+            print(f"Could not close {symbol}, the position is UNPROTECTED")
+        self.close_open_orders(symbol)
 
     def open_order_market(self, symbol, side, volume, leverage, mode, tp, sl):
         self.set_leverage(symbol, leverage)
         self.set_mode(symbol, mode)
-        price = float(self.client.futures_ticker_price(symbol)["price"])
-        qty_precision = self.get_precisions(symbol)[1]
-        price_precision = self.get_precisions(symbol)[0]
+        price = float(
+            self.call("futures_ticker_price", PRIORITY_MARKET, symbol=symbol)["price"]
+        )
+        price_precision, qty_precision = self.get_precisions(symbol)
         qty = round(volume / price, qty_precision)
         if side == "buy":
-            try:
-                resp1 = self.client.futures_new_order(
-                    symbol=symbol,
-                    side="BUY",
-                    type="MARKET",
-                    quantity=qty,
-                    recvWindow=10000,
-                )
-                sleep(1)
-                sl_price = round(price - price * sl, price_precision)
-                resp2 = self.client.futures_new_order(
-                    symbol=symbol,
-                    side="SELL",
-                    type="STOP_MARKET",
-                    quantity=qty,
-                    stopPrice=sl_price,
-                    closePosition="true",
-                    workingType="MARK_PRICE",
-                    recvWindow=10000,
-                )
-                sleep(1)
-                tp_price = round(price + price * tp, price_precision)
-                resp3 = self.client.futures_new_order(
-                    symbol=symbol,
-                    side="SELL",
-                    type="TAKE_PROFIT_MARKET",
-                    quantity=qty,
-                    stopPrice=tp_price,
-                    closePosition="true",
-                    workingType="MARK_PRICE",
-                    recvWindow=10000,
-                )
-            except ClientError as error:
-                print(
-                    f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-                )
-        if side == "sell":
-            try:
-                resp1 = self.client.futures_new_order(
-                    symbol=symbol,
-                    side="SELL",
-                    type="MARKET",
-                    quantity=qty,
-                    recvWindow=10000,
-                )
-                sleep(1)
-                sl_price = round(price + price * sl, price_precision)
-                resp2 = self.client.futures_new_order(
-                    symbol=symbol,
-                    side="BUY",
-                    type="STOP_MARKET",
-                    quantity=qty,
-                    stopPrice=sl_price,
-                    closePosition="true",
-                    workingType="MARK_PRICE",
-                    recvWindow=10000,
-                )
-                sleep(1)
-                tp_price = round(price - price * tp, price_precision)
-                resp3 = self.client.futures_new_order(
-                    symbol=symbol,
-                    side="BUY",
-                    type="TAKE_PROFIT_MARKET",
-                    quantity=qty,
-                    stopPrice=tp_price,
-                    closePosition="true",
-                    workingType="MARK_PRICE",
-                    recvWindow=10000,
-                )
-            except ClientError as error:
-                print(
-                    f"Found error. status: {error.status_code}, error code: {error.error_code}, error message: {error.error_message}"
-                )
+            sl_price = round(price - price * sl, price_precision)
+            tp_price = round(price + price * tp, price_precision)
+        else:
+            sl_price = round(price + price * sl, price_precision)
+            tp_price = round(price - price * tp, price_precision)
+
+        orders = self.entry_orders(
+            symbol,
+            side,
+            f"{qty:.{qty_precision}f}",
+            f"{sl_price:.{price_precision}f}",
+            f"{tp_price:.{price_precision}f}",
+        )
+        start = perf_counter()
+        try:
+            responses = self.place_orders(orders)
+        except BinanceAPIException as error:
+            print_api_error(error)
+            return None
+        latency = (perf_counter() - start) * 1000
+
+        entry, stop_loss, take_profit = responses
+        if "code" in entry:
+            print(f"Entry order on {symbol} failed: {entry['msg']}")
+            self.close_open_orders(symbol)
+            return None
+        if "code" in stop_loss or "code" in take_profit:
+            self.rollback_entry(symbol, side, qty)
+            return None
+
+        self.order_latencies.append(latency)
+        print(f"{symbol} entry protected by SL/TP in {latency:.0f} ms")
         return price, tp_price, sl_price
+
+
+class PriceSnapshot:
+    # Last prices of every USDT symbol from a single ticker request, reused
+    # until they are older than max_age seconds
+
+    def __init__(self, session, max_age=5):
+        self.session = session
+        self.max_age = max_age
+        self.prices = dict()
+        self.updated = 0
+
+    def get(self):
+        if time() - self.updated > self.max_age:
+            tickers = self.session.get_tickers_usdt()
+            if tickers is not None:
+                self.prices = {elem["symbol"]: float(elem["price"]) for elem in tickers}
+                self.updated = time()
+        return self.prices
+
+    def price(self, symbol):
+        return self.get().get(symbol)
@@ -1,11 +1,42 @@
 from time import sleep
-from binance_integration import Binance
-from utils import add_indicators, calculate_position_pnl
-from strategy import Strategy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from binance_integration import Binance, PriceSnapshot
+from utils import (
+    add_indicators,
+    backtest_results_file,
+    backtest_results_json_file,
+    calculate_position_pnl,
+    kline_store,
+    load_indicator_state,
+    portfolio_equity_file,
+    portfolio_results_file,
+    PRICE_MAX_AGE,
+    BATCH_ORDERS,
+    MC_RUNS,
+    MC_RUIN,
+    RESULTS_JSON,
+    STRATEGY,
+    STRATEGY_PARAMS,
+    INTRABAR_EXITS,
+    INTRABAR_TIMEFRAME,
+)
+from indicators import LOOKBACK, OHLCV, compute_indicators, stored_defaults
+from indicator_cache import IndicatorCache
+from streaming import IndicatorStream
+from strategy import get_strategy
 from metrics import Metrics
-import json
+from backtest import frame_arrays, run_backtest
+from portfolio import run_portfolio, portfolio_equity
+from exits import exit_resolver
+from resample import timeframe_ns
+from montecarlo import monte_carlo
+from results import write_results, export_json
+import numpy as np
 import pandas as pd
 
+# Rows read per poll to catch a symbol's stream up with the store
+STREAM_CATCHUP = 500
+
 
 class TradingBot:
     def __init__(
@@ -16,8 +47,9 @@ class TradingBot:
         risk_balance: float,
         max_positions: int = 1,
     ):
-        self.session = Binance(api_key, api_secret)
-        self.strategy = Strategy()
+        self.session = Binance(api_key, api_secret, BATCH_ORDERS)
+        self.prices = PriceSnapshot(self.session, PRICE_MAX_AGE)
+        self.strategy = get_strategy(STRATEGY, **STRATEGY_PARAMS)
         self.metrics = Metrics()
         self.leverage = leverage
         self.risk_balance = risk_balance
@@ -25,71 +57,164 @@ class TradingBot:
         self.positions = list()
         self.trades = list()
         self.kl = dict()
+        self.store = kline_store()
+        self.indicator_cache = IndicatorCache()
+        self.streams = dict()
+        self.live_symbols = set()
 
     """
     Data Functions
     """
 
-    def fetch_kline(self, symbol, timeframe):
-        kl = pd.read_csv(f"data/{symbol}-{timeframe}.csv")
-        kl["Time"] = pd.to_datetime(kl["Time"])
-        kl.set_index("Time", inplace=True)
-        return kl.tail(5000)
+    def fetch_kline(self, symbol, timeframe, tail=5000):
+        # OHLCV plus the columns the strategy reads
+        return self.load_columns(
+            symbol,
+            timeframe,
+            OHLCV + self.strategy.indicators,
+            self.strategy.params,
+            tail,
+        )
+
+    def load_columns(self, symbol, timeframe, names, params=None, tail=None):
+        # Stored columns as they are, the rest (other params or windows, or
+        # resampled timeframes) from the indicator cache
+        stored = self.store.columns(symbol, timeframe)
+        usable = [
+            name
+            for name in names
+            if name in stored and stored_defaults([name], params)
+        ]
+        kl = self.store.load(symbol, timeframe, columns=usable, tail=tail)
+        missing = [
+            name for name in names if name not in usable and name not in OHLCV
+        ]
+        if missing:
+            cached = self.indicator_cache.load(
+                self.store, symbol, timeframe, missing, params, tail=tail
+            )
+            kl = kl.assign(**{name: cached[name] for name in missing})
+        return kl
 
     def fetch_klines(self, symbols, timeframe):
         for symbol in symbols:
             self.kl[symbol] = self.fetch_kline(symbol, timeframe)
 
     def add_signals(self):
-        window = 20
         for symbol, klines in self.kl.items():
-            print(f"Adding signals on {symbol}")
-
-            # Pre-calculate necessary columns for signal determination
-            signals = []
-            signal_prices = []
-
-            for i in range(window, len(klines)):
-                kl_slice = klines.iloc[i - window: i]
-                sign = self.strategy.get_signal(kl_slice)
-                signals.append(sign)
-                signal_prices.append(
-                    kl_slice.Close.iloc[-1] if sign != "hold" else None
-                )
+            self.kl[symbol] = self.signal_frame(symbol, klines)
 
-            # Assign the calculated signals and prices to the DataFrame
-            self.kl[symbol]["signal"] = [None] * window + signals
-            self.kl[symbol]["signal_price"] = [
-                None
-            ] * window + signal_prices
+    def signal_frame(self, symbol, klines):
+        window = 20
+        print(f"Adding signals on {symbol}")
 
-    def create_signal(self, symbol, sign, kl):
+        # Declared indicators missing from frames not read by fetch_kline
+        missing = [name for name in self.strategy.indicators if name not in klines]
+        klines = compute_indicators(klines, missing, self.strategy.params)
+        signals, signal_prices = self.strategy.get_signals(klines)
+
+        # Row i carries the signal of the candle before it, as the
+        # old rolling-window loop did; the first `window` rows stay empty
+        signals = np.concatenate(([None], signals[:-1]))
+        signal_prices = np.concatenate(([np.nan], signal_prices[:-1]))
+        signals[:window] = None
+        signal_prices[:window] = np.nan
+
+        # Assign the calculated signals and prices to the DataFrame
+        klines["signal"] = signals
+        klines["signal_price"] = signal_prices
+        return klines
+
+    def create_signal(self, symbol, sign, entry_price):
         return {
             "symbol": symbol,
             "sign": sign,
-            "entry_price": kl.Close.iloc[-1],
+            "entry_price": entry_price,
         }
 
     """
     Bot Functions
     """
 
+    def update_stream(self, symbol, timeframe):
+        # Feed the candles stored since the last call into the symbol's
+        # streaming indicators, seeding them on first use
+        stream = self.streams.get(symbol)
+        if symbol in self.live_symbols:
+            # Fed by on_candle, the store is not needed any more
+            return stream.values()
+        if stream is None:
+            columns = self.strategy.indicators
+            params = self.strategy.params
+            history = self.store.load(symbol, timeframe, tail=LOOKBACK)
+            state = load_indicator_state(symbol, timeframe)
+            if (
+                state is not None
+                and state["time"] == history.index[-1].value
+                and stored_defaults(columns, params)
+            ):
+                stream = IndicatorStream.from_state(history, state, columns)
+            else:
+                stream = IndicatorStream.from_history(
+                    self.fetch_kline(symbol, timeframe), columns, params
+                )
+            self.streams[symbol] = stream
+        else:
+            kl = self.store.load(symbol, timeframe, tail=STREAM_CATCHUP)
+            kl = kl[kl.index > stream.time]
+            if len(kl) == STREAM_CATCHUP:
+                print(f"{symbol} stream too far behind, reseeding")
+                del self.streams[symbol]
+                return self.update_stream(symbol, timeframe)
+            for row in zip(kl.index, kl.High, kl.Low, kl.Close):
+                stream.update(*row)
+        return stream.values()
+
+    def on_candle(self, symbol, timeframe, candle):
+        # Closed candle from market_data.MarketData
+        if symbol not in self.streams:
+            self.update_stream(symbol, timeframe)
+        stream = self.streams[symbol]
+        if candle.time <= stream.time:
+            return stream.values()
+        if candle.time - stream.time > pd.Timedelta(timeframe):
+            self.backfill_stream(symbol, timeframe, candle.time)
+        self.live_symbols.add(symbol)
+        return stream.update(candle.time, candle.high, candle.low, candle.close)
+
+    def backfill_stream(self, symbol, timeframe, until):
+        # Candles missing between the stored history and the first streamed one
+        stream = self.streams[symbol]
+        kl = self.session.klines(symbol, timeframe)
+        if kl is None:
+            return
+        kl = kl[(kl.index > stream.time) & (kl.index < until)]
+        print(f"Backfilling {len(kl)} {symbol} candles")
+        for row in zip(kl.index, kl.High, kl.Low, kl.Close):
+            stream.update(*row)
+
     def look_for_signals(self, symbols, timeframe):
         signals = []
         for symbol in symbols:
-            kl = self.fetch_kline(symbol, timeframe)
-            sign = self.strategy.get_signal(kl)
+            values = self.update_stream(symbol, timeframe)
+            sign = self.strategy.evaluate(values)
             if sign != "hold" and symbol not in self.positions:
-                signals.append(self.create_signal(symbol, sign, kl))
+                signals.append(
+                    self.create_signal(symbol, sign, values["Close"])
+                )
                 sleep(1)
         return signals
 
     def open_real_position(self, symbol, sign, qty, mode, tp, sl):
-        entry_price, tp_price, sl_price = self.session.open_order_market(
+        prices = self.session.open_order_market(
             symbol, sign, qty, self.leverage, mode, tp, sl
         )
+        if prices is None:
+            return None
+        entry_price, tp_price, sl_price = prices
         lended_qty = qty / entry_price
         position = {
+            "symbol": symbol,
             "entry_price": entry_price,
             "tp_price": tp_price,
             "sl_price": sl_price,
@@ -100,105 +225,57 @@ class TradingBot:
         return position
 
     def update_positions_pnl(self):
-        for position in self.positions:
-            last_close = self.session.get_ticker_usdt(position["symbol"])
-            pnl = calculate_position_pnl(position, last_close)
-            position["pnl"] = pnl
-
-    def enter_trade(self, entry_date, entry_price, sign, tp, sl, balance):
-        trade = {
-            "entry_date": entry_date,
-            "exit_date": None,
-            "entry_price": entry_price,
-            "exit_price": 0,
-            "qty": balance * self.leverage * self.risk_balance,
-            "sign": sign,
-            "open": True,
+        if not self.positions:
+            return
+        prices = self.prices.get()
+        columns = {
+            "sign": np.array([p["sign"] for p in self.positions]),
+            "entry_price": np.array([p["entry_price"] for p in self.positions]),
+            "lended_qty": np.array([p["lended_qty"] for p in self.positions]),
         }
-        if sign == "buy":
-            trade["tp_price"] = entry_price * (1 + tp)
-            trade["sl_price"] = entry_price * (1 - sl)
-        else:
-            trade["tp_price"] = entry_price * (1 - tp)
-            trade["sl_price"] = entry_price * (1 + sl)
-        return trade
+        last_close = np.array(
+            [prices.get(p["symbol"], np.nan) for p in self.positions]
+        )
+        pnl = calculate_position_pnl(columns, last_close)
+        for position, value in zip(self.positions, pnl.tolist()):
+            position["pnl"] = value
 
     """
     Backtest Functions
     """
 
-    def backtest_strategy(self, symbol, tp, sl, balance):
-        trades = []
-        in_position = False
-        updated_balance = balance
-
-        for i in range(3, len(self.kl[symbol])):
-            kl_slice = self.kl[symbol].iloc[:i]
-            sign = kl_slice["signal"].iloc[-1]
-            if in_position:
-                trade = trades[-1]
-                if trade["sign"] == "buy":
-                    if (
-                        kl_slice.Close.iloc[-1] >= trade["tp_price"]
-                        or kl_slice.Close.iloc[-1] <= trade["sl_price"]
-                    ):
-                        trade["exit_date"] = kl_slice.index[-1]
-                        trade["exit_price"] = kl_slice.Close.iloc[-1]
-                        trade["open"] = False
-                        in_position = False
-                        trade["pnl"] = calculate_position_pnl(
-                            trade, kl_slice.Close.iloc[-1]
-                        )
-                        trade["final_balance"] = (
-                            trade["starting_balance"] + trade["pnl"]
-                        )
-                        updated_balance = trade["final_balance"]
-                else:
-                    if (
-                        kl_slice.Close.iloc[-1] <= trade["tp_price"]
-                        or kl_slice.Close.iloc[-1] >= trade["sl_price"]
-                    ):
-                        trade["exit_date"] = kl_slice.index[-1]
-                        trade["exit_price"] = kl_slice.Close.iloc[-1]
-                        trade["open"] = False
-                        in_position = False
-                        trade["pnl"] = calculate_position_pnl(
-                            trade, kl_slice.Close.iloc[-1]
-                        )
-                        trade["final_balance"] = (
-                            trade["starting_balance"] + trade["pnl"]
-                        )
-                        updated_balance = trade["final_balance"]
-
-            else:
-                if sign != "hold":
-                    trade = self.enter_trade(
-                        kl_slice.index[-1],
-                        kl_slice.Close.iloc[-1],
-                        sign,
-                        tp,
-                        sl,
-                        updated_balance,
-                    )
-                    trade["starting_balance"] = updated_balance
-                    trade["lended_qty"] = trade["qty"] / trade["entry_price"]
-                    trade["pnl"] = calculate_position_pnl(
-                        trade, kl_slice.Close.iloc[-1]
-                    )
-                    updated_balance -= trade["starting_balance"] * \
-                        self.risk_balance
-                    trades.append(trade)
-                    in_position = True
-
-        if trades and trades[-1]["open"]:
-            trades[-1]["exit_price"] = self.kl[symbol].Close.iloc[-1]
-            trades[-1]["pnl"] = calculate_position_pnl(
-                trades[-1], self.kl[symbol].Close.iloc[-1]
+    def exit_resolver(self, symbol, timeframe, kl):
+        # TP/SL against the candles' High/Low, with the INTRABAR_TIMEFRAME
+        # candles (when stored) deciding candles that reach both levels.
+        # None keeps the Close only checks.
+        if not INTRABAR_EXITS or "High" not in kl or "Low" not in kl:
+            return None
+        lower = None
+        if (
+            timeframe is not None
+            and INTRABAR_TIMEFRAME is not None
+            and timeframe_ns(INTRABAR_TIMEFRAME) < timeframe_ns(timeframe)
+            and self.store.exists(symbol, INTRABAR_TIMEFRAME)
+        ):
+            lower = self.store.load(
+                symbol, INTRABAR_TIMEFRAME, columns=["High", "Low"]
             )
-            trades[-1]["starting_balance"] = updated_balance
-            updated_balance = updated_balance + trades[-1]["pnl"]
-            trades[-1]["final_balance"] = updated_balance
-        return trades
+        return exit_resolver(kl, lower)
+
+    def backtest_arrays(self, symbol, tp, sl, balance, exits=None):
+        # exits: the exit_resolver of the symbol, None for Close only checks
+        close, side, times = frame_arrays(self.kl[symbol])
+        return run_backtest(
+            close,
+            side,
+            times,
+            tp,
+            sl,
+            balance,
+            self.leverage,
+            self.risk_balance,
+            exits,
+        )
 
     def write_backtest_results(
         self,
@@ -209,6 +286,7 @@ class TradingBot:
         balance,
         trades,
         metrics,
+        montecarlo=None,
     ):
         config = {
             "symbol": symbol,
@@ -219,22 +297,110 @@ class TradingBot:
             "balance": balance,
             "risk_balance": self.risk_balance,
         }
-        result = {"metrics": metrics, "trades": trades, "config": config}
+        result = {"metrics": metrics, "config": config}
+        if montecarlo is not None:
+            result["montecarlo"] = montecarlo
 
-        # Save result to a JSON file
-        with open(f"results/backtest_results_{symbol}.json", "w") as f:
-            json.dump(result, f, indent=4)
+        # Trades are stored as typed columns, see results.py
+        write_results(backtest_results_file(symbol), trades, result)
+        if RESULTS_JSON:
+            export_json(
+                backtest_results_file(symbol), backtest_results_json_file(symbol)
+            )
+
+    def backtest_symbol(self, symbol, timeframe, tp, sl, balance):
+        kl = self.kl[symbol]
+        columns = self.backtest_arrays(
+            symbol, tp, sl, balance, self.exit_resolver(symbol, timeframe, kl)
+        )
+        close, _, times = frame_arrays(kl)
+        metrics = self.metrics.calculate(columns, close, times, balance)
+        montecarlo = monte_carlo(columns["pnl"], balance, MC_RUNS, ruin=MC_RUIN)
+        self.write_backtest_results(
+            symbol, timeframe, tp, sl, balance, columns, metrics, montecarlo
+        )
+        return metrics
 
     def backtest(self, symbols, timeframe, tp, sl, balance):
         for symbol in symbols:
-            trades = self.backtest_strategy(symbol, tp, sl, balance)
-            metrics = self.metrics.calculate_metrics(trades, balance)
-            for trade in trades:
-                if isinstance(trade.get("exit_date"), pd.Timestamp):
-                    trade["exit_date"] = trade["exit_date"].isoformat()
-
-                if isinstance(trade.get("entry_date"), pd.Timestamp):
-                    trade["entry_date"] = trade["entry_date"].isoformat()
-            self.write_backtest_results(
-                symbol, timeframe, tp, sl, balance, trades, metrics
-            )
+            self.backtest_symbol(symbol, timeframe, tp, sl, balance)
+
+    def backtest_portfolio(self, symbols, timeframe, tp, sl, balance, tail=5000):
+        # All symbols on one balance with max_positions, as the live loop
+        # trades them. Only the arrays of each symbol (and its exit
+        # resolver) are kept, not its frame.
+        arrays = {}
+        exits = {}
+        for symbol in symbols:
+            kl = self.signal_frame(symbol, self.fetch_kline(symbol, timeframe, tail))
+            arrays[symbol] = frame_arrays(kl)
+            exits[symbol] = self.exit_resolver(symbol, timeframe, kl)
+        trades = run_portfolio(
+            arrays,
+            tp,
+            sl,
+            balance,
+            self.leverage,
+            self.risk_balance,
+            self.max_positions,
+            exits,
+        )
+        times, equity, in_position = portfolio_equity(arrays, trades, balance)
+        metrics = self.metrics.calculate_portfolio(
+            trades, equity, in_position, times, balance
+        )
+        montecarlo = monte_carlo(trades["pnl"], balance, MC_RUNS, ruin=MC_RUIN)
+        config = {
+            # trades["symbol"] indexes this list
+            "symbols": sorted(symbols),
+            "timeframe": timeframe,
+            "tp": tp,
+            "sl": sl,
+            "leverage": self.leverage,
+            "balance": balance,
+            "risk_balance": self.risk_balance,
+            "max_positions": self.max_positions,
+        }
+        write_results(
+            portfolio_results_file(),
+            trades,
+            {"metrics": metrics, "config": config, "montecarlo": montecarlo},
+        )
+        write_results(
+            portfolio_equity_file(),
+            {"time": times, "equity": equity},
+            {"config": config},
+        )
+        return metrics
+
+    def backtest_parallel(self, symbols, timeframe, tp, sl, balance, workers=None):
+        # Every symbol runs its whole pipeline in a worker and writes its own
+        # results file, so the output is the same as a serial run
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _backtest_worker,
+                    symbol,
+                    timeframe,
+                    tp,
+                    sl,
+                    balance,
+                    self.leverage,
+                    self.risk_balance,
+                ): symbol
+                for symbol in symbols
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                symbol = futures[future]
+                metrics = future.result()
+                print(
+                    f"[{done}/{len(symbols)}] {symbol}: "
+                    f"ROI {metrics['roi']}% final balance {metrics['final_balance']}"
+                )
+
+
+def _backtest_worker(symbol, timeframe, tp, sl, balance, leverage, risk_balance):
+    bot = TradingBot(None, None, leverage, risk_balance)
+    bot.fetch_klines([symbol], timeframe)
+    bot.add_signals()
+    return bot.backtest_symbol(symbol, timeframe, tp, sl, balance)
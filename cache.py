@@ -0,0 +1,40 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Values kept per key together with the version they were built from
+    # (e.g. a file mtime). A lookup with a different version rebuilds the
+    # value, so stale entries are replaced instead of piling up. The least
+    # recently used key is dropped past maxsize.
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, load):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Loaded outside the lock so a slow load does not block other keys
+        value = load()
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from time import perf_counter
+import aiohttp
+import numpy as np
+import pandas as pd
+from rate_limit import PRIORITY_MARKET, RequestScheduler
+from utils import DATA_PATH, kline_store, store_klines
+
+FUTURES_API_URL = "https://fapi.binance.com"
+KLINES_LIMIT = 1000
+MAX_RETRIES = 5
+
+
+def klines_weight(limit):
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def interval_ms(timeframe):
+    return int(pd.Timedelta(timeframe).total_seconds() * 1000)
+
+
+class KlineDownloader:
+
+    def __init__(
+        self,
+        store=None,
+        base_url=FUTURES_API_URL,
+        concurrency=10,
+        scheduler=None,
+        checkpoint_path=os.path.join(DATA_PATH, ".download"),
+        limit=KLINES_LIMIT,
+    ):
+        self.store = store if store is not None else kline_store()
+        self.base_url = base_url
+        self.concurrency = concurrency
+        # Pass the bot's Binance.scheduler to share its weight budget
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.checkpoint_path = checkpoint_path
+        self.limit = limit
+
+    def checkpoint_dir(self, symbol, timeframe):
+        return os.path.join(self.checkpoint_path, f"{symbol}-{timeframe}")
+
+    def checkpoint_file(self, symbol, timeframe, chunk):
+        # Keyed by both ends: a resumed run with a later end re-fetches a last
+        # chunk that was only partly closed before
+        start, end = chunk
+        return os.path.join(
+            self.checkpoint_dir(symbol, timeframe), f"{start}-{end}.json"
+        )
+
+    def plan_chunks(self, start, end, step):
+        # [start, end) in ms split into requests of `limit` candles
+        span = self.limit * step
+        return [(s, min(s + span, end) - 1) for s in range(start, end, span)]
+
+    async def fetch_chunk(self, session, semaphore, symbol, timeframe, chunk):
+        start, end = chunk
+        path = self.checkpoint_file(symbol, timeframe, chunk)
+        if os.path.exists(path):
+            return
+        params = {
+            "symbol": symbol,
+            "interval": timeframe,
+            "startTime": start,
+            "endTime": end,
+            "limit": self.limit,
+        }
+        for attempt in range(MAX_RETRIES):
+            async with semaphore:
+                status, klines = await self.get_klines(session, params)
+            if status in (429, 418):
+                # The scheduler holds every call until Retry-After has passed
+                continue
+            if status >= 500:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            # Written only once the chunk is complete, so a resumed run can
+            # trust every file it finds
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(klines, f)
+            os.replace(f"{path}.tmp", path)
+            return
+        raise RuntimeError(f"Could not download {symbol} {timeframe} {chunk}")
+
+    async def get_klines(self, session, params):
+        # Through the same RequestScheduler as the REST client: one weight
+        # budget, market data priority behind orders and account calls
+        await asyncio.to_thread(
+            self.scheduler.acquire, PRIORITY_MARKET, klines_weight(self.limit)
+        )
+        started = perf_counter()
+        try:
+            async with session.get(
+                f"{self.base_url}/fapi/v1/klines", params=params
+            ) as resp:
+                self.scheduler.observe(resp.status, resp.headers)
+                if resp.status in (429, 418) or resp.status >= 500:
+                    return resp.status, None
+                resp.raise_for_status()
+                return resp.status, await resp.json()
+        finally:
+            self.scheduler.release("futures_klines", started)
+
+    def merge_chunks(self, symbol, timeframe, step, chunks):
+        # Only this run's chunks, files left from an older range are ignored
+        klines = []
+        for chunk in chunks:
+            with open(self.checkpoint_file(symbol, timeframe, chunk)) as f:
+                klines.extend(json.load(f))
+        if not klines:
+            return None
+        data = np.array([k[:6] for k in klines], dtype=np.float64)
+        # Sort by open time and drop candles returned by two chunks
+        open_time, first = np.unique(data[:, 0].astype(np.int64), return_index=True)
+        data = data[first]
+
+        gaps = np.flatnonzero(np.diff(open_time) != step)
+        for i in gaps:
+            print(
+                f"{symbol} {timeframe} gap: "
+                f"{pd.Timestamp(open_time[i], unit='ms')} -> "
+                f"{pd.Timestamp(open_time[i + 1], unit='ms')}"
+            )
+
+        df = pd.DataFrame(
+            data[:, 1:], columns=["Open", "High", "Low", "Close", "Volume"]
+        )
+        df.index = pd.DatetimeIndex(pd.to_datetime(open_time, unit="ms"), name="Time")
+        return df
+
+    def date_range(self, symbol, timeframe, start, step):
+        if self.store.exists(symbol, timeframe):
+            last = self.store.load(symbol, timeframe, columns=["Close"], tail=1)
+            if len(last):
+                start = last.index[-1].value // 1_000_000 + step
+        else:
+            start = pd.Timestamp(start).value // 1_000_000
+        # Stop at the last closed candle
+        now = int(time.time() * 1000)
+        end = now - now % step
+        return start, end
+
+    async def download_symbol(self, session, semaphore, symbol, timeframe, start):
+        step = interval_ms(timeframe)
+        first, end = self.date_range(symbol, timeframe, start, step)
+        chunks = self.plan_chunks(first, end, step)
+        if not chunks:
+            print(f"{symbol} {timeframe} up to date")
+            return
+        os.makedirs(self.checkpoint_dir(symbol, timeframe), exist_ok=True)
+        await asyncio.gather(
+            *(
+                self.fetch_chunk(session, semaphore, symbol, timeframe, chunk)
+                for chunk in chunks
+            )
+        )
+        df = self.merge_chunks(symbol, timeframe, step, chunks)
+        if df is not None:
+            added = store_klines(self.store, symbol, timeframe, df)
+            print(f"{symbol} {timeframe}: {added} candles added")
+        shutil.rmtree(self.checkpoint_dir(symbol, timeframe))
+
+    async def download(self, symbols, timeframes, start):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(
+                *(
+                    self.download_symbol(session, semaphore, symbol, timeframe, start)
+                    for symbol in symbols
+                    for timeframe in timeframes
+                )
+            )
+
+    def run(self, symbols, timeframes, start):
+        asyncio.run(self.download(symbols, timeframes, start))
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of `threshold` points that keep
+    # the visual shape of the series (first and last point always kept)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # threshold - 2 buckets between the first and the last point
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(
+        np.int64
+    ) + 1
+    edges[-1] = n - 1
+    # Average point of every bucket, plus the last point as the bucket that
+    # follows the final one
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Twice the triangle area against the previous pick and the average
+        # of the next bucket, the constant terms do not change the argmax
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (avg_y[i + 1] - y[a])
+        )
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
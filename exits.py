@@ -0,0 +1,135 @@
+import numpy as np
+
+
+class RangeTable:
+    # Sparse table over a High (highest=True) or Low series: level j holds
+    # the max (min) of values[i: i + 2 ** j]. The first candle reaching a
+    # price is found by skipping whole blocks that stay short of it, one
+    # block at a time, so a query costs O(log n) instead of a scan.
+
+    def __init__(self, values, highest=True):
+        self.highest = highest
+        op = np.maximum if highest else np.minimum
+        levels = [np.ascontiguousarray(values, dtype=np.float64)]
+        width = 1
+        while 2 * width <= len(levels[0]):
+            previous = levels[-1]
+            levels.append(op(previous[:-width], previous[width:]))
+            width *= 2
+        # Queries read one value at a time, faster through memoryviews
+        self.levels = [memoryview(level) for level in levels]
+
+    def __reduce__(self):
+        # Rebuilt from the values when sent to worker processes
+        return RangeTable, (np.asarray(self.levels[0]), self.highest)
+
+    def first(self, start, stop, price):
+        # First i in [start, stop) with values[i] >= price (<= for a Low
+        # series), -1 if there is none
+        # Plain Python numbers, numpy scalars would slow every step down
+        i, stop, price = int(start), int(stop), float(price)
+        # Blocks twice as long each time while they stay short of the price,
+        # then back down, so a touch d candles away costs O(log d)
+        j = 0
+        while j < len(self.levels) and i + (1 << j) <= stop:
+            if not self.short(self.levels[j][i], price):
+                break
+            i += 1 << j
+            j += 1
+        for j in range(j - 1, -1, -1):
+            if i + (1 << j) <= stop and self.short(self.levels[j][i], price):
+                i += 1 << j
+        return i if i < stop else -1
+
+    def short(self, value, price):
+        return value < price if self.highest else value > price
+
+
+class ExitResolver:
+    # TP/SL checked against each candle's High/Low instead of its Close, as
+    # the stop orders placed live fire inside the candle. A stop filled past
+    # its price when the candle already opened beyond it. When one candle
+    # reaches both, the `lower` timeframe candles inside it (times, high,
+    # low) tell which came first; without them, or if a single lower candle
+    # reaches both too, the SL is taken as the worst case.
+
+    def __init__(self, open_, high, low, times, lower=None):
+        self.open = np.asarray(open_, dtype=np.float64)
+        self.highs = RangeTable(high, highest=True)
+        self.lows = RangeTable(low, highest=False)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.lower = lower
+        self.drilled = 0
+
+    def find(self, start, stop, side, tp_price, sl_price):
+        # (exit_idx, exit_price) of the first candle in [start, stop) that
+        # reaches TP or SL, (-1, nan) if none does
+        if side == 1:
+            tp_idx = self.highs.first(start, stop, tp_price)
+            sl_idx = self.lows.first(start, stop, sl_price)
+        else:
+            tp_idx = self.lows.first(start, stop, tp_price)
+            sl_idx = self.highs.first(start, stop, sl_price)
+        if tp_idx == -1 and sl_idx == -1:
+            return -1, np.nan
+        if sl_idx == -1 or -1 < tp_idx < sl_idx:
+            return tp_idx, self.fill(tp_idx, side, tp_price)
+        if tp_idx == -1 or sl_idx < tp_idx:
+            return sl_idx, self.fill(sl_idx, -side, sl_price)
+        if self.tp_first(tp_idx, side, tp_price, sl_price):
+            return tp_idx, self.fill(tp_idx, side, tp_price)
+        return sl_idx, self.fill(sl_idx, -side, sl_price)
+
+    def fill(self, i, direction, price):
+        # The candle's open when it gapped past the price (above it for
+        # direction 1, below for -1)
+        if direction * (self.open[i] - price) >= 0:
+            return self.open[i]
+        return price
+
+    def tp_first(self, i, side, tp_price, sl_price):
+        if side * (self.open[i] - tp_price) >= 0:
+            return True
+        if side * (sl_price - self.open[i]) >= 0:
+            return False
+        if self.lower is None:
+            return False
+        self.drilled += 1
+        times, high, low = self.lower
+        if i + 1 < len(self.times):
+            end = self.times[i + 1]
+        else:
+            end = 2 * self.times[i] - self.times[i - 1]
+        a, b = times.searchsorted([self.times[i], end])
+        if side == 1:
+            tp_hit = high[a:b] >= tp_price
+            sl_hit = low[a:b] <= sl_price
+        else:
+            tp_hit = low[a:b] <= tp_price
+            sl_hit = high[a:b] >= sl_price
+        # Lower candles that never reach a level count as after the others
+        tp_at = tp_hit.argmax() if tp_hit.any() else b - a
+        sl_at = sl_hit.argmax() if sl_hit.any() else b - a
+        return tp_at < sl_at
+
+
+def exit_resolver(kl, lower=None):
+    # From a klines frame (Open/High/Low) and optionally the frame of a lower
+    # timeframe, only the part of it from kl's first candle on is kept
+    times = kl.index.values.astype("datetime64[ns]").view(np.int64)
+    lower_arrays = None
+    if lower is not None:
+        lower_times = lower.index.values.astype("datetime64[ns]").view(np.int64)
+        start = lower_times.searchsorted(times[0]) if len(times) else 0
+        lower_arrays = (
+            lower_times[start:],
+            lower.High.to_numpy(dtype=np.float64)[start:],
+            lower.Low.to_numpy(dtype=np.float64)[start:],
+        )
+    return ExitResolver(
+        kl.Open.to_numpy(dtype=np.float64),
+        kl.High.to_numpy(dtype=np.float64),
+        kl.Low.to_numpy(dtype=np.float64),
+        times,
+        lower_arrays,
+    )
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from indicators import (
+    DEFAULT_PARAMS,
+    IndicatorFrame,
+    ema_window,
+    indicator_group,
+)
+from utils import DATA_PATH, INDICATOR_CACHE_BYTES
+
+# Windows of history recomputed in front of appended candles, enough for the
+# recursive indicators (EMA, RSI, ADX) to forget where they were seeded
+CACHE_WARMUP = 40
+
+
+class IndicatorCache:
+    # Indicator columns over a symbol's whole stored history, one entry per
+    # column group on disk, named by a hash of symbol, timeframe, first
+    # candle, group and the params it uses. An entry covers the history up
+    # to its last candle; newer candles are added by recomputing only a
+    # warmup tail. Least recently used entries go past max_bytes.
+
+    def __init__(
+        self,
+        path=os.path.join(DATA_PATH, ".indicators"),
+        max_bytes=INDICATOR_CACHE_BYTES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.extends = 0
+        self.misses = 0
+
+    def key(self, symbol, timeframe, start, columns, params):
+        source = json.dumps(
+            [symbol, timeframe, int(start), columns, params], sort_keys=True
+        )
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, f"{key}.npy")
+
+    def read(self, key):
+        try:
+            with open(os.path.join(self.path, f"{key}.json")) as f:
+                meta = json.load(f)
+            values = np.load(self.file(key), mmap_mode="r")
+            # Used now, so it is the last one evicted
+            os.utime(self.file(key))
+        except (FileNotFoundError, ValueError):
+            return None, None
+        # The data can be ahead of its meta while another process writes
+        return meta, values[:, : meta["length"]]
+
+    def write(self, key, meta, values):
+        os.makedirs(self.path, exist_ok=True)
+        # Data first, then the meta that points at it
+        np.save(f"{self.file(key)}.tmp.npy", values)
+        os.replace(f"{self.file(key)}.tmp.npy", self.file(key))
+        path = os.path.join(self.path, f"{key}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp", path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith(".npy") and ".tmp" not in name:
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name[:-4]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for suffix in (".json", ".npy"):
+                try:
+                    os.remove(os.path.join(self.path, key + suffix))
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def load(self, store, symbol, timeframe, names, params=None, tail=None):
+        # `names` over the last `tail` stored candles (all if None)
+        params = {**DEFAULT_PARAMS, **(params or {})}
+        ohlcv = store.load(symbol, timeframe, columns=["High", "Low", "Close"])
+        times = ohlcv.index.values.astype("datetime64[ns]").view(np.int64)
+        n = len(times)
+        frame = IndicatorFrame(ohlcv, params)
+        columns = {}
+        for name in names:
+            if name in columns:
+                continue
+            group, param_names = indicator_group(name)
+            used = {key: params[key] for key in param_names}
+            key = self.key(symbol, timeframe, times[0], group, used)
+            meta, values = self.read(key)
+            length = 0 if meta is None else meta["length"]
+            if meta is not None and (
+                length > n or times[length - 1] != meta["end"]
+            ):
+                # The stored history was rewritten under this entry
+                length = 0
+
+            if length == n:
+                self.hits += 1
+            elif length > 0:
+                self.extends += 1
+                window = max(list(used.values()) + [ema_window(name) or 0])
+                start = max(0, length - CACHE_WARMUP * window)
+                recent = IndicatorFrame(ohlcv.iloc[start:], params)
+                new = np.array(
+                    [recent[column].to_numpy()[length - start:] for column in group]
+                )
+                values = np.concatenate((values, new), axis=1)
+            else:
+                self.misses += 1
+                values = np.array([frame[column].to_numpy() for column in group])
+            if length != n:
+                meta = {
+                    "symbol": symbol,
+                    "timeframe": timeframe,
+                    "columns": group,
+                    "params": used,
+                    "length": n,
+                    "end": int(times[-1]),
+                }
+                self.write(key, meta, values)
+            for column, row in zip(group, values):
+                columns[column] = row
+
+        start = 0 if tail is None else max(0, n - tail)
+        return pd.DataFrame(
+            {name: columns[name][start:] for name in names},
+            index=ohlcv.index[start:],
+        )
@@ -0,0 +1,366 @@
+import re
+import numpy as np
+import pandas as pd
+import ta
+
+# Windows used by utils.add_indicators
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGN = 9
+RSI_WINDOW = 14
+STOCH_SMOOTH = 3
+BB_WINDOW = 20
+BB_DEV = 2
+EMA_WINDOW = 200
+ADX_WINDOW = 14
+
+# Stored rows an update needs to see for the rolling windows (Bollinger,
+# StochRSI min/max and its %K/%D smoothing)
+LOOKBACK = BB_WINDOW
+# Below this many stored rows some indicator is still warming up, so the
+# update falls back to a full recompute
+MIN_HISTORY = EMA_WINDOW
+
+INDICATOR_COLUMNS = [
+    "macd",
+    "macd_diff",
+    "macd_signal",
+    "rsi",
+    "stoch_rsi",
+    "stoch_rsi_k",
+    "stoch_rsi_d",
+    "bb_upper",
+    "bb_lower",
+    "bb_mid",
+    "ema_200",
+    "adx",
+]
+
+OHLCV = ["Open", "High", "Low", "Close", "Volume"]
+
+# Parameters of the stored columns; a strategy can override any of them
+DEFAULT_PARAMS = {
+    "macd_fast": MACD_FAST,
+    "macd_slow": MACD_SLOW,
+    "macd_sign": MACD_SIGN,
+    "rsi_window": RSI_WINDOW,
+    "stoch_smooth": STOCH_SMOOTH,
+    "bb_window": BB_WINDOW,
+    "bb_dev": BB_DEV,
+    "adx_window": ADX_WINDOW,
+}
+
+
+def _ewm_last(values, **kwargs):
+    return float(pd.Series(values).ewm(adjust=False, **kwargs).mean().iloc[-1])
+
+
+def _ewm_from(previous, values, **kwargs):
+    # Continue an adjust=False ewm from its last value; pandas seeds the
+    # recursion with the first element, so this matches a full run
+    series = pd.Series(np.concatenate(([previous], values)))
+    return series.ewm(adjust=False, **kwargs).mean().to_numpy()[1:]
+
+
+def _rsi_directions(diff):
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    return up, down
+
+
+def _rsi(up_avg, down_avg):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(down_avg == 0, 100, 100 - (100 / (1 + up_avg / down_avg)))
+
+
+def _true_range(high, low, prev_close):
+    return np.maximum(high, prev_close) - np.minimum(low, prev_close)
+
+
+def _directional_movement(high, low, prev_high, prev_low):
+    diff_up = high - prev_high
+    diff_down = prev_low - low
+    pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.0)
+    neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.0)
+    return pos, neg
+
+
+def _directional_index(trs, dip, din):
+    di_pos = 100 * (dip / trs) if trs != 0 else 0
+    di_neg = 100 * (din / trs) if trs != 0 else 0
+    if di_pos + di_neg != 0:
+        return 100 * np.abs((di_pos - di_neg) / (di_pos + di_neg))
+    return 0
+
+
+def _adx_state(high, low, close):
+    # Replays ta's ADXIndicator recursion and keeps its running sums
+    w = ADX_WINDOW
+    tr = _true_range(high[1:], low[1:], close[:-1])
+    pos, neg = _directional_movement(high[1:], low[1:], high[:-1], low[:-1])
+    trs = float(pd.Series(tr[:w]).sum())
+    dip = float(pd.Series(pos[:w]).sum())
+    din = float(pd.Series(neg[:w]).sum())
+    dx = [_directional_index(trs, dip, din)]
+    adx = 0.0
+    for j in range(w, len(tr)):
+        trs = trs - (trs / float(w)) + tr[j]
+        dip = dip - (dip / float(w)) + pos[j]
+        din = din - (din / float(w)) + neg[j]
+        if len(dx) < w:
+            dx.append(_directional_index(trs, dip, din))
+            if len(dx) == w:
+                adx = float(np.mean(dx))
+        else:
+            adx = ((adx * (w - 1)) + _directional_index(trs, dip, din)) / float(w)
+    return {"trs": trs, "dip": dip, "din": din, "adx": adx}
+
+
+def indicator_state(data):
+    # Running state at the last row of a full OHLCV history
+    close = data.Close.to_numpy(dtype=np.float64)
+    up, down = _rsi_directions(np.diff(close, prepend=np.nan))
+    ema_fast = pd.Series(close).ewm(span=MACD_FAST, adjust=False).mean()
+    ema_slow = pd.Series(close).ewm(span=MACD_SLOW, adjust=False).mean()
+    macd = (ema_fast - ema_slow).to_numpy()
+    macd[: MACD_SLOW - 1] = np.nan
+    state = {
+        "time": int(data.index[-1].value),
+        "ema_fast": float(ema_fast.iloc[-1]),
+        "ema_slow": float(ema_slow.iloc[-1]),
+        "macd_signal": _ewm_last(macd, span=MACD_SIGN),
+        "rsi_up": _ewm_last(up, alpha=1 / RSI_WINDOW),
+        "rsi_down": _ewm_last(down, alpha=1 / RSI_WINDOW),
+        "ema_200": _ewm_last(close, span=EMA_WINDOW),
+    }
+    state["adx"] = _adx_state(
+        data.High.to_numpy(dtype=np.float64),
+        data.Low.to_numpy(dtype=np.float64),
+        close,
+    )
+    return state
+
+
+def update_indicators(history, new, state):
+    # history: last LOOKBACK stored rows (with indicators), new: OHLCV rows
+    # after them. Returns the indicator columns for `new` and the new state.
+    close = new.Close.to_numpy(dtype=np.float64)
+    high = new.High.to_numpy(dtype=np.float64)
+    low = new.Low.to_numpy(dtype=np.float64)
+    prev_close = np.concatenate(([history.Close.iloc[-1]], close[:-1]))
+    prev_high = np.concatenate(([history.High.iloc[-1]], high[:-1]))
+    prev_low = np.concatenate(([history.Low.iloc[-1]], low[:-1]))
+    out = new.copy()
+
+    # MACD
+    ema_fast = _ewm_from(state["ema_fast"], close, span=MACD_FAST)
+    ema_slow = _ewm_from(state["ema_slow"], close, span=MACD_SLOW)
+    macd = ema_fast - ema_slow
+    macd_signal = _ewm_from(state["macd_signal"], macd, span=MACD_SIGN)
+    out["macd"] = macd
+    out["macd_diff"] = macd - macd_signal
+    out["macd_signal"] = macd_signal
+
+    # RSI
+    up, down = _rsi_directions(close - prev_close)
+    rsi_up = _ewm_from(state["rsi_up"], up, alpha=1 / RSI_WINDOW)
+    rsi_down = _ewm_from(state["rsi_down"], down, alpha=1 / RSI_WINDOW)
+    out["rsi"] = _rsi(rsi_up, rsi_down)
+
+    # Stoch RSI
+    rsi = pd.Series(np.concatenate((history.rsi.to_numpy(), out["rsi"])))
+    lowest = rsi.rolling(RSI_WINDOW).min()
+    stoch_rsi = (rsi - lowest) / (rsi.rolling(RSI_WINDOW).max() - lowest)
+    stoch_rsi = pd.Series(
+        np.concatenate((history.stoch_rsi.to_numpy(), stoch_rsi[len(history):]))
+    )
+    stoch_rsi_k = stoch_rsi.rolling(STOCH_SMOOTH).mean()
+    stoch_rsi_k = pd.Series(
+        np.concatenate(
+            (history.stoch_rsi_k.to_numpy(), stoch_rsi_k[len(history):])
+        )
+    )
+    stoch_rsi_d = stoch_rsi_k.rolling(STOCH_SMOOTH).mean()
+    out["stoch_rsi"] = stoch_rsi.to_numpy()[len(history):]
+    out["stoch_rsi_k"] = stoch_rsi_k.to_numpy()[len(history):]
+    out["stoch_rsi_d"] = stoch_rsi_d.to_numpy()[len(history):]
+
+    # Bollinger Bands
+    closes = pd.Series(np.concatenate((history.Close.to_numpy(), close)))
+    mavg = closes.rolling(BB_WINDOW).mean().to_numpy()[len(history):]
+    mstd = closes.rolling(BB_WINDOW).std(ddof=0).to_numpy()[len(history):]
+    out["bb_upper"] = mavg + BB_DEV * mstd
+    out["bb_lower"] = mavg - BB_DEV * mstd
+    out["bb_mid"] = mavg
+
+    # EMA 200
+    ema_200 = _ewm_from(state["ema_200"], close, span=EMA_WINDOW)
+    out["ema_200"] = ema_200
+
+    # ADX
+    w = ADX_WINDOW
+    adx_state = dict(state["adx"])
+    tr = _true_range(high, low, prev_close)
+    pos, neg = _directional_movement(high, low, prev_high, prev_low)
+    adx = np.empty(len(new))
+    for i in range(len(new)):
+        for key, value in (("trs", tr[i]), ("dip", pos[i]), ("din", neg[i])):
+            adx_state[key] = adx_state[key] - (adx_state[key] / float(w)) + value
+        dx = _directional_index(
+            adx_state["trs"], adx_state["dip"], adx_state["din"]
+        )
+        adx_state["adx"] = ((adx_state["adx"] * (w - 1)) + dx) / float(w)
+        adx[i] = adx_state["adx"]
+    out["adx"] = adx
+
+    new_state = {
+        "time": int(new.index[-1].value),
+        "ema_fast": float(ema_fast[-1]),
+        "ema_slow": float(ema_slow[-1]),
+        "macd_signal": float(macd_signal[-1]),
+        "rsi_up": float(rsi_up[-1]),
+        "rsi_down": float(rsi_down[-1]),
+        "ema_200": float(ema_200[-1]),
+        "adx": adx_state,
+    }
+    return out, new_state
+
+
+# Indicator registry: every column a strategy can ask for, computed lazily
+
+
+def _macd_columns(frame, params):
+    macd = ta.trend.MACD(
+        frame["Close"],
+        window_fast=params["macd_fast"],
+        window_slow=params["macd_slow"],
+        window_sign=params["macd_sign"],
+    )
+    return {
+        "macd": macd.macd(),
+        "macd_diff": macd.macd_diff(),
+        "macd_signal": macd.macd_signal(),
+    }
+
+
+def _rsi_columns(frame, params):
+    return {"rsi": ta.momentum.rsi(frame["Close"], window=params["rsi_window"])}
+
+
+def _stoch_rsi_columns(frame, params):
+    # ta's StochRSIIndicator on the shared RSI column instead of its own
+    rsi = frame["rsi"]
+    window = params["rsi_window"]
+    lowest = rsi.rolling(window).min()
+    stoch_rsi = (rsi - lowest) / (rsi.rolling(window).max() - lowest)
+    stoch_rsi_k = stoch_rsi.rolling(params["stoch_smooth"]).mean()
+    return {
+        "stoch_rsi": stoch_rsi,
+        "stoch_rsi_k": stoch_rsi_k,
+        "stoch_rsi_d": stoch_rsi_k.rolling(params["stoch_smooth"]).mean(),
+    }
+
+
+def _bollinger_columns(frame, params):
+    bb = ta.volatility.BollingerBands(
+        frame["Close"], window=params["bb_window"], window_dev=params["bb_dev"]
+    )
+    return {
+        "bb_upper": bb.bollinger_hband(),
+        "bb_lower": bb.bollinger_lband(),
+        "bb_mid": bb.bollinger_mavg(),
+    }
+
+
+def _adx_columns(frame, params):
+    adx = ta.trend.ADXIndicator(
+        frame["High"], frame["Low"], frame["Close"], window=params["adx_window"]
+    )
+    return {"adx": adx.adx()}
+
+
+# Column -> (function computing its group of columns, parameters it uses)
+REGISTRY = {
+    "macd": (_macd_columns, ("macd_fast", "macd_slow", "macd_sign")),
+    "macd_diff": (_macd_columns, ("macd_fast", "macd_slow", "macd_sign")),
+    "macd_signal": (_macd_columns, ("macd_fast", "macd_slow", "macd_sign")),
+    "rsi": (_rsi_columns, ("rsi_window",)),
+    "stoch_rsi": (_stoch_rsi_columns, ("rsi_window", "stoch_smooth")),
+    "stoch_rsi_k": (_stoch_rsi_columns, ("rsi_window", "stoch_smooth")),
+    "stoch_rsi_d": (_stoch_rsi_columns, ("rsi_window", "stoch_smooth")),
+    "bb_upper": (_bollinger_columns, ("bb_window", "bb_dev")),
+    "bb_lower": (_bollinger_columns, ("bb_window", "bb_dev")),
+    "bb_mid": (_bollinger_columns, ("bb_window", "bb_dev")),
+    "adx": (_adx_columns, ("adx_window",)),
+}
+
+
+def ema_window(name):
+    # "ema_100" -> 100, any window can be asked for by name
+    match = re.fullmatch(r"ema_(\d+)", name)
+    return int(match.group(1)) if match else None
+
+
+def indicator_spec(name):
+    if name in REGISTRY:
+        return REGISTRY[name]
+    window = ema_window(name)
+    if window is not None:
+        return (
+            lambda frame, params: {
+                name: ta.trend.ema_indicator(frame["Close"], window=window)
+            },
+            (),
+        )
+    raise KeyError(f"Unknown indicator {name}")
+
+
+def indicator_group(name):
+    # Columns computed together with `name` and the params they depend on
+    compute, param_names = indicator_spec(name)
+    columns = [column for column, spec in REGISTRY.items() if spec[0] is compute]
+    return columns or [name], param_names
+
+
+def stored_defaults(columns, params=None):
+    # True when every column is one extract_data stores and `params` do not
+    # change how it is computed, so the stored values can be used as they are
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    return all(
+        name in INDICATOR_COLUMNS
+        and all(params[key] == DEFAULT_PARAMS[key] for key in indicator_spec(name)[1])
+        for name in columns
+        if name not in OHLCV
+    )
+
+
+class IndicatorFrame:
+    # Indicator columns of one OHLCV frame, each group computed the first
+    # time one of its columns is read. Dependencies are read through the
+    # frame too, so the RSI is computed once for rsi and the Stoch RSI.
+    # Columns already in `data` are reused when built with the same params.
+
+    def __init__(self, data, params=None):
+        self.data = data
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.computed = {}
+
+    def __getitem__(self, name):
+        if name in self.computed:
+            return self.computed[name]
+        if name in OHLCV:
+            return self.data[name]
+        compute, param_names = indicator_spec(name)
+        if name in self.data.columns and all(
+            self.params[key] == DEFAULT_PARAMS[key] for key in param_names
+        ):
+            return self.data[name]
+        self.computed.update(compute(self, self.params))
+        return self.computed[name]
+
+
+def compute_indicators(data, columns, params=None):
+    # `data` with the requested indicator columns added, nothing else is
+    # computed
+    frame = IndicatorFrame(data, params)
+    return data.assign(**{name: frame[name] for name in columns})
@@ -11,9 +11,36 @@ from utils import (
     LEVERAGE,
     RISK_BALANCE,
     BALANCE,
+    TP_GRID,
+    SL_GRID,
+    LEVERAGE_GRID,
+    RISK_BALANCE_GRID,
+    WORKERS,
+    WF_TRAIN_BARS,
+    WF_TEST_BARS,
+    WF_OVERSOLD_GRID,
+    WF_OVERBOUGHT_GRID,
+    WF_OBJECTIVE,
+    STRATEGY,
+    MC_SWEEP_RUNS,
+    MC_RUIN,
+    DATA_PATH,
+    STORAGE,
+    DOWNLOAD_TIMEFRAMES,
+    DOWNLOAD_START,
+    DOWNLOAD_CONCURRENCY,
+    backtest_results_file,
+    backtest_results_json_file,
     extract_data,
 )
 from bot import TradingBot
+from streaming import IndicatorStream
+from sweep import run_sweep, write_sweep_results
+from walkforward import run_walkforward, write_walkforward_results
+from storage import migrate_csv
+from results import export_json
+from downloader import KlineDownloader
+from market_data import MarketData, BinanceKlineSource, ReplayKlineSource
 
 
 def run(
@@ -22,11 +49,28 @@ def run(
     timeframe: str,
     tp: float,
     sl: float,
+    market: MarketData = None,
 ):
     mode = "ISOLATED"
+    if market is None:
+        market = MarketData(
+            symbols, timeframe, BinanceKlineSource(symbols, timeframe)
+        )
+    market.start()
 
     while True:
         try:
+            # Evaluate right after candles close instead of polling
+            closes = market.wait_for_closes(timeout=5)
+            if not closes:
+                if market.finished.is_set():
+                    print("Market data finished")
+                    break
+                continue
+            for symbol, candle in closes:
+                bot.on_candle(symbol, timeframe, candle)
+            closed_symbols = sorted({symbol for symbol, _ in closes})
+
             balance = bot.session.get_balance_usdt()
             positions = bot.session.get_positions()
             orders = bot.session.check_orders()
@@ -47,8 +91,8 @@ def run(
                 )
 
             if len(positions) < bot.max_positions:
-                print("Looking for signals...")
-                signals = bot.look_for_signals(symbols, timeframe)
+                print(f"Looking for signals on {closed_symbols}...")
+                signals = bot.look_for_signals(closed_symbols, timeframe)
                 if signals:
                     for signal in signals:
                         bot.open_real_position(
@@ -56,10 +100,6 @@ def run(
                         )
                         if len(positions) >= bot.max_positions:
                             break
-
-            wait = 60 * 2
-            print(f"Waiting {wait} sec")
-            sleep(wait)
         except Exception as err:
             print(err)
             sleep(30)
@@ -67,9 +107,39 @@ def run(
             print("Finishing...")
             df = pd.DataFrame(bot.trades)
             print(df)
+            latencies = bot.session.order_latencies
+            if latencies:
+                print(
+                    f"Entry to SL/TP latency: avg {sum(latencies) / len(latencies):.0f} ms, "
+                    f"max {max(latencies):.0f} ms over {len(latencies)} entries"
+                )
+            stats = bot.session.scheduler.stats()
+            print(
+                f"Requests: {stats['used_weight']} weight used this minute, "
+                f"max queue depth {stats['max_queue_depth']}"
+            )
+            for name, latency in stats["latency"].items():
+                print(
+                    f"  {name}: {latency['calls']} calls, "
+                    f"avg {latency['avg_ms']:.0f} ms, max {latency['max_ms']:.0f} ms"
+                )
             break
 
 
+def replay(bot: TradingBot, symbols: list, timeframe: str, start: str):
+    # Offline dry run: stored candles go through the same market data and
+    # streaming indicator path as the live loop, signals are only printed
+    source = ReplayKlineSource(bot.store, symbols, timeframe, start=start)
+    market = MarketData(symbols, timeframe, source)
+    market.start()
+    while not (market.finished.is_set() and market.closed.empty()):
+        for symbol, candle in market.wait_for_closes(timeout=1):
+            values = bot.on_candle(symbol, timeframe, candle)
+            sign = bot.strategy.evaluate(values)
+            if sign != "hold":
+                print(f"{candle.time} {symbol} {sign} @ {values['Close']}")
+
+
 if __name__ == "__main__":
 
     if len(sys.argv) > 1:
@@ -82,8 +152,27 @@ if __name__ == "__main__":
         )
         if sys.argv[1] == "run":
             run(bot, SYMBOLS, TIMEFRAME, TP, SL)
+        elif sys.argv[1] == "replay":
+            # Seed from history up to the start date, replay the rest
+            start = pd.Timestamp(sys.argv[2])
+            for symbol in SYMBOLS:
+                kl = bot.store.load(symbol, TIMEFRAME, columns=["High", "Low", "Close"])
+                bot.streams[symbol] = IndicatorStream.from_history(
+                    kl[kl.index < start],
+                    bot.strategy.indicators,
+                    bot.strategy.params,
+                )
+            replay(bot, SYMBOLS, TIMEFRAME, start)
         elif sys.argv[1] == "extract":
             extract_data()
+        elif sys.argv[1] == "download":
+            start = sys.argv[2] if len(sys.argv) > 2 else DOWNLOAD_START
+            downloader = KlineDownloader(
+                concurrency=DOWNLOAD_CONCURRENCY, scheduler=bot.session.scheduler
+            )
+            downloader.run(SYMBOLS, DOWNLOAD_TIMEFRAMES, start)
+        elif sys.argv[1] == "migrate":
+            migrate_csv(SYMBOLS, TIMEFRAME, DATA_PATH, STORAGE)
         elif sys.argv[1] == "backtest":
             print("Fetching klines...")
             bot.fetch_klines(SYMBOLS, TIMEFRAME)
@@ -91,3 +180,86 @@ if __name__ == "__main__":
             bot.add_signals()
             print("Running backtest...")
             bot.backtest(SYMBOLS, TIMEFRAME, TP, SL, BALANCE)
+        elif sys.argv[1] == "backtest-portfolio":
+            print(
+                f"Backtesting {SYMBOLS} ({TIMEFRAME}) on one balance, "
+                f"max {bot.max_positions} positions"
+            )
+            metrics = bot.backtest_portfolio(SYMBOLS, TIMEFRAME, TP, SL, BALANCE)
+            print(
+                f"ROI {metrics['roi']}% final balance {metrics['final_balance']} "
+                f"max drawdown {metrics['max_drawdown']}"
+            )
+        elif sys.argv[1] == "export-results":
+            for symbol in SYMBOLS:
+                export_json(
+                    backtest_results_file(symbol), backtest_results_json_file(symbol)
+                )
+        elif sys.argv[1] == "backtest-parallel":
+            workers = int(sys.argv[2]) if len(sys.argv) > 2 else WORKERS
+            print(f"Backtesting on {SYMBOLS} ({TIMEFRAME}) with {workers} workers")
+            bot.backtest_parallel(SYMBOLS, TIMEFRAME, TP, SL, BALANCE, workers)
+        elif sys.argv[1] == "sweep":
+            print("Fetching klines...")
+            bot.fetch_klines(SYMBOLS, TIMEFRAME)
+            bot.add_signals()
+            print(f"Sweeping TP/SL on {SYMBOLS} ({TIMEFRAME})")
+            exits = {
+                symbol: bot.exit_resolver(symbol, TIMEFRAME, kl)
+                for symbol, kl in bot.kl.items()
+            }
+            results = run_sweep(
+                bot.kl,
+                BALANCE,
+                TP_GRID,
+                SL_GRID,
+                LEVERAGE_GRID,
+                RISK_BALANCE_GRID,
+                workers=WORKERS,
+                mc_runs=MC_SWEEP_RUNS,
+                ruin=MC_RUIN,
+                exits=exits,
+            )
+            write_sweep_results(results)
+            print(results.head(10))
+        elif sys.argv[1] == "walkforward":
+            # Whole stored history, only the columns the strategy reads
+            klines = {
+                symbol: bot.fetch_kline(symbol, TIMEFRAME, tail=None)[
+                    ["Close"] + bot.strategy.indicators
+                ]
+                for symbol in SYMBOLS
+            }
+            print(f"Walk-forward on {SYMBOLS} ({TIMEFRAME})")
+            reports = run_walkforward(
+                klines,
+                BALANCE,
+                LEVERAGE,
+                RISK_BALANCE,
+                TP_GRID,
+                SL_GRID,
+                WF_OVERSOLD_GRID,
+                WF_OVERBOUGHT_GRID,
+                WF_TRAIN_BARS,
+                WF_TEST_BARS,
+                objective=WF_OBJECTIVE,
+                workers=WORKERS,
+                strategy=STRATEGY,
+            )
+            config = {
+                "strategy": STRATEGY,
+                "timeframe": TIMEFRAME,
+                "leverage": LEVERAGE,
+                "balance": BALANCE,
+                "risk_balance": RISK_BALANCE,
+                "train_bars": WF_TRAIN_BARS,
+                "test_bars": WF_TEST_BARS,
+                "objective": WF_OBJECTIVE,
+            }
+            for symbol, report in reports.items():
+                write_walkforward_results(symbol, report, config)
+                metrics = report["metrics"]
+                print(
+                    f"{symbol}: {len(report['folds'])} folds, out-of-sample ROI "
+                    f"{metrics['roi']}% max drawdown {metrics['max_drawdown']}"
+                )
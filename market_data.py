@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import json
+import queue
+import threading
+from collections import deque
+import pandas as pd
+import websockets
+
+FUTURES_WS_URL = "wss://fstream.binance.com/stream"
+# Binance accepts up to 200 streams per connection
+STREAMS_PER_CONNECTION = 200
+
+
+class Candle:
+    __slots__ = ("time", "open", "high", "low", "close", "volume")
+
+    def __init__(self, time, open, high, low, close, volume):
+        self.time = time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+
+class CandleBuffer:
+    # Last `maxlen` closed candles of one symbol
+
+    def __init__(self, maxlen):
+        self.candles = deque(maxlen=maxlen)
+
+    def append(self, candle):
+        self.candles.append(candle)
+
+    def __len__(self):
+        return len(self.candles)
+
+    def last(self):
+        return self.candles[-1] if self.candles else None
+
+    def to_frame(self):
+        kl = pd.DataFrame(
+            [
+                (c.time, c.open, c.high, c.low, c.close, c.volume)
+                for c in self.candles
+            ],
+            columns=["Time", "Open", "High", "Low", "Close", "Volume"],
+        )
+        return kl.set_index("Time")
+
+
+def parse_kline(message):
+    # Combined stream payload: {"stream": ..., "data": {"e": "kline", ...}}
+    data = message.get("data", message)
+    k = data["k"]
+    candle = Candle(
+        pd.Timestamp(k["t"], unit="ms"),
+        float(k["o"]),
+        float(k["h"]),
+        float(k["l"]),
+        float(k["c"]),
+        float(k["v"]),
+    )
+    return data["s"], candle, k["x"]
+
+
+def kline_message(symbol, timeframe, row, closed=True):
+    start = int(row.Index.value // 1_000_000)
+    return {
+        "stream": f"{symbol.lower()}@kline_{timeframe}",
+        "data": {
+            "e": "kline",
+            "s": symbol,
+            "k": {
+                "t": start,
+                "i": timeframe,
+                "o": str(row.Open),
+                "h": str(row.High),
+                "l": str(row.Low),
+                "c": str(row.Close),
+                "v": str(row.Volume),
+                "x": closed,
+            },
+        },
+    }
+
+
+class BinanceKlineSource:
+    # Futures kline websocket, one connection per 200 streams, reconnecting
+    # with backoff
+
+    def __init__(self, symbols, timeframe, url=FUTURES_WS_URL):
+        streams = [f"{symbol.lower()}@kline_{timeframe}" for symbol in symbols]
+        self.urls = [
+            f"{url}?streams=" + "/".join(streams[i: i + STREAMS_PER_CONNECTION])
+            for i in range(0, len(streams), STREAMS_PER_CONNECTION)
+        ]
+
+    async def _listen(self, url, messages):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(url, ping_interval=20) as ws:
+                    delay = 1
+                    async for raw in ws:
+                        await messages.put(json.loads(raw))
+            except (OSError, websockets.WebSocketException) as err:
+                # Dropped connections and failed handshakes (HTTP 429/503)
+                print(f"Kline stream disconnected ({err}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def messages(self):
+        messages = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._listen(url, messages)) for url in self.urls
+        ]
+
+        def stopped(task):
+            # Anything else ends the stream instead of leaving it waiting
+            if not task.cancelled() and task.exception() is not None:
+                messages.put_nowait(task.exception())
+
+        for task in tasks:
+            task.add_done_callback(stopped)
+        try:
+            while True:
+                message = await messages.get()
+                if isinstance(message, Exception):
+                    raise message
+                yield message
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class ReplayKlineSource:
+    # Offline stand-in: replays stored candles as websocket payloads, merged
+    # across symbols in time order
+
+    def __init__(self, store, symbols, timeframe, start=None, delay=0):
+        self.store = store
+        self.symbols = symbols
+        self.timeframe = timeframe
+        self.start = start
+        self.delay = delay
+
+    def _rows(self, symbol):
+        kl = self.store.load(
+            symbol, self.timeframe, columns=["Open", "High", "Low", "Close", "Volume"]
+        )
+        if self.start is not None:
+            kl = kl[kl.index >= self.start]
+        for row in kl.itertuples():
+            yield row.Index, symbol, row
+
+    async def messages(self):
+        merged = heapq.merge(
+            *(self._rows(symbol) for symbol in self.symbols),
+            key=lambda item: (item[0], item[1]),
+        )
+        for _, symbol, row in merged:
+            yield kline_message(symbol, self.timeframe, row)
+            await asyncio.sleep(self.delay)
+
+
+class MarketData:
+    # Keeps a ring buffer of closed candles per symbol and reports every close
+    # through `closed` (for the trading loop) and the optional on_close hook
+
+    def __init__(self, symbols, timeframe, source, maxlen=1000, on_close=None):
+        self.symbols = symbols
+        self.timeframe = timeframe
+        self.source = source
+        self.on_close = on_close
+        self.buffers = {symbol: CandleBuffer(maxlen) for symbol in symbols}
+        self.closed = queue.Queue()
+        self.finished = threading.Event()
+        self._thread = None
+
+    def handle(self, message):
+        if "data" not in message and "k" not in message:
+            return
+        symbol, candle, is_closed = parse_kline(message)
+        if not is_closed or symbol not in self.buffers:
+            return
+        last = self.buffers[symbol].last()
+        if last is not None and candle.time <= last.time:
+            return
+        self.buffers[symbol].append(candle)
+        self.closed.put((symbol, candle))
+        if self.on_close is not None:
+            self.on_close(symbol, candle)
+
+    async def run(self):
+        try:
+            async for message in self.source.messages():
+                self.handle(message)
+        finally:
+            self.finished.set()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self.run(),), daemon=True
+        )
+        self._thread.start()
+
+    def wait_for_closes(self, timeout=None):
+        # Blocks until at least one candle closes, then returns every close
+        # queued so far
+        closes = []
+        try:
+            closes.append(self.closed.get(timeout=timeout))
+        except queue.Empty:
+            return closes
+        while True:
+            try:
+                closes.append(self.closed.get_nowait())
+            except queue.Empty:
+                return closes
@@ -1,74 +1,192 @@
 import numpy as np
+import pandas as pd
 import datetime as dt
 
+# Cells (runs x bars) of equity built at once by calculate_batch
+BATCH_CELLS = 2 ** 22
+YEAR = pd.Timedelta(days=365).value
 
-class Metrics:
 
-    def calculate_metrics(self, trades, initial_balance):
-        wins = []
-        losses = []
+def periods_per_year(times):
+    # Bars per year from the spacing of the int64 ns timestamps
+    if len(times) < 2:
+        return 1
+    step = np.median(np.diff(np.asarray(times, dtype=np.int64)))
+    return YEAR / step if step > 0 else 1
 
-        for trade in trades:
-            if trade["pnl"] > 0:
-                wins.append(trade["pnl"])
-            else:
-                losses.append(trade["pnl"])
 
-        win_ratio = len(wins) / len(trades) if trades else 0
-        average_win = np.mean(wins) if wins else 0
-        average_loss = np.mean(losses) if losses else 0
-        risk_reward_ratio = -average_win / average_loss if average_loss else 0
+def _date(value):
+    date = pd.Timestamp(value)
+    return f"{date.year}-{date.month}-{date.day}"
 
-        total_profit = sum(t["pnl"] for t in trades)
-        roi = (total_profit / initial_balance) * 100
 
-        max_drawdown = self.calculate_max_drawdown(trades, initial_balance)
+def _concat_trades(runs):
+    return {
+        name: np.concatenate([run[name] for run in runs])
+        for name in (
+            "entry_idx",
+            "exit_idx",
+            "entry_price",
+            "side",
+            "lended_qty",
+            "pnl",
+            "open",
+        )
+    }
 
-        sum_pnl_win = sum(t["pnl"] for t in trades if t["pnl"] > 0)
-        sum_pnl_loss = sum(t["pnl"] for t in trades if t["pnl"] < 0)
-        profit_factor = sum_pnl_win / abs(sum_pnl_loss) if sum_pnl_loss != 0 else 0
 
-        if len(trades) > 0:
+def _grouped_cumsum(values, groups):
+    # Cumulative sum restarting at every new group (groups sorted)
+    total = np.cumsum(values)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    offset = np.repeat(
+        total[starts] - values[starts], np.diff(np.r_[starts, len(values)])
+    )
+    return total - offset
 
-            start_date = f"{trades[0]['entry_date'].year}-{trades[0]['entry_date'].month}-{trades[0]['entry_date'].day}"
 
-            if trades[-1]["exit_date"]:
-                end_date = f"{trades[-1]['exit_date'].year}-{trades[-1]['exit_date'].month}-{trades[-1]['exit_date'].day}"
-            else:
-                end_date = f"{trades[-2]['exit_date'].year}-{trades[-2]['exit_date'].month}-{trades[-2]['exit_date'].day}"
-        else:
-            start_date = None
-            end_date = None
+class Metrics:
 
-        final_balance = (
-            trades[-1]["final_balance"] if len(trades) > 0 else initial_balance
+    def calculate(self, trades, close, times, initial_balance):
+        return self.calculate_batch([trades], close, times, initial_balance)[0]
+
+    def calculate_batch(self, runs, close, times, initial_balance):
+        # runs: columnar trade tables (backtest.run_backtest) over the same
+        # close series, e.g. every TP/SL combination of one symbol
+        close = np.asarray(close, dtype=np.float64)
+        rows_per_chunk = max(1, BATCH_CELLS // max(len(close), 1))
+        periods = periods_per_year(times)
+        results = []
+        for i in range(0, len(runs), rows_per_chunk):
+            chunk = runs[i: i + rows_per_chunk]
+            equity, in_trade = self.equity_curves(chunk, close, initial_balance)
+            results.extend(
+                self._summarize(chunk, equity, in_trade, initial_balance, periods)
+            )
+        return results
+
+    def calculate_portfolio(
+        self, trades, equity, in_position, times, initial_balance
+    ):
+        # Many symbols on one shared balance (portfolio.py): the equity curve
+        # is given, the final balance is where it ends
+        metrics = self._summarize(
+            [trades],
+            equity[None],
+            in_position[None],
+            initial_balance,
+            periods_per_year(times),
+        )[0]
+        metrics["final_balance"] = round(float(equity[-1]), 2)
+        return metrics
+
+    def equity_curves(self, runs, close, initial_balance):
+        # Mark-to-market equity of every run at every bar: the balance before
+        # the entry plus the open trade's unrealized pnl, the realized balance
+        # between trades. Built for all runs at once on a flat runs x bars grid.
+        n = len(close)
+        cells = len(runs) * n
+        trades = _concat_trades(runs)
+        if len(trades["pnl"]) == 0:
+            equity = np.full((len(runs), n), float(initial_balance))
+            return equity, np.zeros((len(runs), n), dtype=bool)
+
+        run_of_trade = np.repeat(
+            np.arange(len(runs)), [len(run["pnl"]) for run in runs]
+        )
+        # Balance after each trade, chained from initial_balance, so an open
+        # trade is not charged its margin like in final_balance
+        balance_after = initial_balance + _grouped_cumsum(trades["pnl"], run_of_trade)
+        balance_before = balance_after - trades["pnl"]
+        exit_idx = np.where(trades["open"], n - 1, trades["exit_idx"])
+
+        flat = np.arange(cells)
+        run = flat // n
+        bar = flat - run * n
+        k = np.searchsorted(run_of_trade * n + trades["entry_idx"], flat, "right") - 1
+        started = k >= 0
+        k = np.maximum(k, 0)
+        started &= run_of_trade[k] == run
+        in_trade = started & (bar <= exit_idx[k])
+
+        unrealized = (
+            trades["side"][k]
+            * (close[bar] - trades["entry_price"][k])
+            * trades["lended_qty"][k]
+        )
+        equity = np.where(
+            in_trade,
+            balance_before[k] + unrealized,
+            np.where(started, balance_after[k], initial_balance),
         )
+        return equity.reshape(len(runs), n), in_trade.reshape(len(runs), n)
+
+    def _summarize(self, runs, equity, in_trade, initial_balance, periods):
+        # Every equity based figure for the whole chunk in one pass per array
+        peak = np.maximum.accumulate(equity, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drawdown = np.where(peak > 0, (peak - equity) / peak, 0).max(axis=1)
+            # Nothing left to compound once the account is wiped out
+            previous = equity[:, :-1]
+            returns = np.where(previous > 0, equity[:, 1:] / previous - 1, 0)
+        mean = returns.mean(axis=1)
+        std = returns.std(axis=1)
+        downside = np.sqrt((np.minimum(returns, 0) ** 2).mean(axis=1))
+        bars = equity.shape[1]
+        growth = np.maximum(equity[:, -1], 0) / initial_balance
+        annual_return = growth ** (periods / max(bars - 1, 1)) - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sharpe = np.where(std > 0, mean / std * np.sqrt(periods), 0)
+            sortino = np.where(downside > 0, mean / downside * np.sqrt(periods), 0)
+            calmar = np.where(drawdown > 0, annual_return / drawdown, 0)
+        exposure = in_trade.mean(axis=1)
+
+        results = []
+        for i, trades in enumerate(runs):
+            metrics = self._trade_metrics(trades, initial_balance)
+            metrics.update(
+                {
+                    "max_drawdown": round(float(drawdown[i]), 2),
+                    "sharpe": round(float(sharpe[i]), 2),
+                    "sortino": round(float(sortino[i]), 2),
+                    "calmar": round(float(calmar[i]), 2),
+                    "exposure": round(float(exposure[i]), 2),
+                }
+            )
+            results.append(metrics)
+        return results
+
+    def _trade_metrics(self, trades, initial_balance):
+        # Per-trade fields from the run_backtest columns.
+        # max_drawdown is filled in from the equity curve
+        pnl = trades["pnl"]
+        wins = pnl[pnl > 0]
+        losses = pnl[pnl <= 0]
+        win_ratio = len(wins) / len(pnl) if len(pnl) else 0
+        average_win = wins.mean() if len(wins) else 0
+        average_loss = losses.mean() if len(losses) else 0
+        risk_reward_ratio = -average_win / average_loss if average_loss else 0
+        sum_pnl_loss = pnl[pnl < 0].sum()
+        profit_factor = wins.sum() / abs(sum_pnl_loss) if sum_pnl_loss != 0 else 0
+
+        start_date = end_date = None
+        if len(pnl):
+            start_date = _date(trades["entry_time"][0])
+            closed = trades["exit_time"][~trades["open"]]
+            if len(closed):
+                end_date = _date(closed[-1])
 
+        final_balance = trades["final_balance"][-1] if len(pnl) else initial_balance
         return {
             "initial_balance": round(initial_balance, 2),
-            "final_balance": round(final_balance, 2),
+            "final_balance": round(float(final_balance), 2),
             "win_ratio": round(win_ratio, 2),
-            "average_win": round(average_win, 2),
-            "average_loss": round(average_loss, 2),
-            "risk_reward_ratio": round(risk_reward_ratio, 2),
-            "roi": round(roi, 2),
-            "max_drawdown": round(max_drawdown, 2),
-            "profit_factor": round(profit_factor, 2),
+            "average_win": round(float(average_win), 2),
+            "average_loss": round(float(average_loss), 2),
+            "risk_reward_ratio": round(float(risk_reward_ratio), 2),
+            "roi": round(float(pnl.sum() / initial_balance * 100), 2),
+            "max_drawdown": 0,
+            "profit_factor": round(float(profit_factor), 2),
             "start_date": start_date,
             "end_date": end_date,
         }
-
-    def calculate_max_drawdown(self, trades, initial_balance):
-        peak = initial_balance
-        max_drawdown = 0
-        capital = initial_balance
-
-        for trade in trades:
-            capital += trade["pnl"]
-            if capital > peak:
-                peak = capital
-            drawdown = (peak - capital) / peak
-            if drawdown > max_drawdown:
-                max_drawdown = drawdown
-
-        return max_drawdown
@@ -0,0 +1,69 @@
+import numpy as np
+
+# Cells (paths x trades) simulated at once
+MC_CELLS = 2 ** 22
+PERCENTILES = (5, 50, 95)
+
+
+def trade_returns(pnl, initial_balance):
+    # Trade pnl as a fraction of the equity it was taken with; position size
+    # follows the balance, so paths are rebuilt by compounding these
+    pnl = np.asarray(pnl, dtype=np.float64)
+    before = initial_balance + np.concatenate(([0.0], np.cumsum(pnl)[:-1]))
+    # Nothing after the account was wiped out can be resampled
+    alive = np.flatnonzero(before <= 0)
+    if len(alive):
+        pnl, before = pnl[: alive[0]], before[: alive[0]]
+    return pnl / before
+
+
+def _paths(returns, rows, method, rng):
+    n = len(returns)
+    if method == "shuffle":
+        order = rng.permuted(np.tile(np.arange(n), (rows, 1)), axis=1)
+    else:
+        order = rng.integers(0, n, size=(rows, n))
+    # Equity as a multiple of the initial balance, stuck at 0 once ruined
+    return np.cumprod(np.maximum(1 + returns[order], 0), axis=1)
+
+
+def monte_carlo(
+    pnl,
+    initial_balance,
+    runs=10000,
+    method="bootstrap",
+    ruin=0.5,
+    seed=0,
+):
+    # Resamples ("bootstrap", with replacement) or reorders ("shuffle") the
+    # trade sequence `runs` times. Drawdowns are measured on trade closes.
+    # Risk of ruin is the share of paths that lose `ruin` of the balance.
+    returns = trade_returns(pnl, initial_balance)
+    if len(returns) == 0:
+        return None
+    rng = np.random.default_rng(seed)
+    rows_per_chunk = max(1, MC_CELLS // len(returns))
+    finals = np.empty(runs)
+    drawdowns = np.empty(runs)
+    ruined = np.empty(runs, dtype=bool)
+    for start in range(0, runs, rows_per_chunk):
+        rows = min(rows_per_chunk, runs - start)
+        equity = _paths(returns, rows, method, rng)
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), 1)
+        finals[start: start + rows] = equity[:, -1] * initial_balance
+        drawdowns[start: start + rows] = (1 - equity / peak).max(axis=1)
+        ruined[start: start + rows] = equity.min(axis=1) <= 1 - ruin
+
+    final_balance = np.percentile(finals, PERCENTILES)
+    max_drawdown = np.percentile(drawdowns, PERCENTILES)
+    return {
+        "runs": runs,
+        "method": method,
+        "final_balance": {
+            f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, final_balance)
+        },
+        "max_drawdown": {
+            f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, max_drawdown)
+        },
+        "risk_of_ruin": round(float(ruined.mean()), 4),
+    }
@@ -0,0 +1,196 @@
+import heapq
+import numpy as np
+from backtest import NAT, START_ROW, TRADE_COLUMNS, exit_levels, find_exit
+
+# Trade columns of a portfolio run: the single symbol ones, the margin taken
+# from the shared balance and the symbol's position in the sorted symbols
+PORTFOLIO_COLUMNS = {**TRADE_COLUMNS, "margin": np.float64, "symbol": np.int32}
+
+
+def run_portfolio(
+    arrays, tp, sl, balance, leverage, risk_balance, max_positions, exits=None
+):
+    # arrays: symbol -> (close, side, times) as backtest.frame_arrays gives,
+    # exits: symbol -> exits.ExitResolver for the High/Low checks.
+    # The entry candidates of every symbol are merged into one stream by
+    # time, the way the live loop sees candles close: positions exiting at a
+    # time are settled before entries at that time, ties go by symbol, a
+    # symbol with an open position is skipped and at most max_positions are
+    # open at once. Margin comes out of one shared balance and qty is sized
+    # on what is free.
+    symbols = sorted(arrays)
+    rows = []
+    owners = []
+    starts = []
+    for s, symbol in enumerate(symbols):
+        close, side, times = arrays[symbol]
+        found = np.flatnonzero(side[: len(close) - 1] != 0)
+        found = found[found >= START_ROW]
+        rows.append(found)
+        owners.append(np.full(len(found), s, dtype=np.int32))
+        starts.append(times[found])
+    # One sort instead of a k-way merge: by time, then symbol
+    starts = np.concatenate(starts)
+    order = np.lexsort((np.concatenate(owners), starts))
+    starts = starts[order]
+    rows = np.concatenate(rows)[order].tolist()
+    owners = np.concatenate(owners)[order].tolist()
+    times_list = starts.tolist()
+
+    columns = {name: [] for name in PORTFOLIO_COLUMNS}
+    # (exit_time, symbol, trade) of the positions closed by their TP/SL
+    pending = []
+    positions = 0
+    # First row each symbol may enter at again
+    next_row = [START_ROW] * len(symbols)
+    # Balance with the closed pnl and the margin held by open positions;
+    # what is free is their difference
+    realized = balance
+    in_use = 0
+    i = 0
+    while i < len(rows):
+        time = times_list[i]
+        while pending and pending[0][0] <= time:
+            _, _, trade = heapq.heappop(pending)
+            realized += columns["pnl"][trade]
+            in_use -= columns["margin"][trade]
+            columns["final_balance"][trade] = realized - in_use
+            positions -= 1
+
+        if positions >= max_positions:
+            if not pending:
+                # The open positions only end with the data
+                break
+            # Nothing can open before the next exit, skip to it
+            i = starts.searchsorted(pending[0][0])
+            continue
+
+        s = owners[i]
+        entry = rows[i]
+        i += 1
+        if entry < next_row[s]:
+            continue
+
+        close, side, times = arrays[symbols[s]]
+        last = len(close) - 1
+        sign = side[entry]
+        entry_price = close[entry]
+        starting_balance = realized - in_use
+        qty = starting_balance * leverage * risk_balance
+        margin = starting_balance * risk_balance
+        lended_qty = qty / entry_price
+        tp_price, sl_price = exit_levels(sign, entry_price, tp, sl)
+        in_use += margin
+
+        resolver = None if exits is None else exits.get(symbols[s])
+        if resolver is None:
+            exit_idx = find_exit(close, entry + 1, last, sign, tp_price, sl_price)
+            exit_price = close[exit_idx]
+        else:
+            exit_idx, exit_price = resolver.find(
+                entry + 1, last, sign, tp_price, sl_price
+            )
+        is_open = exit_idx == -1
+        if is_open:
+            exit_price = close[last]
+        if sign == 1:
+            pnl = (exit_price - entry_price) * lended_qty
+        else:
+            pnl = (entry_price - exit_price) * lended_qty
+
+        trade = len(columns["pnl"])
+        if is_open:
+            # Reported like run_backtest does for its last open trade
+            starting_balance = realized - in_use
+            final_balance = starting_balance + pnl
+            next_row[s] = last
+        else:
+            # Filled in when the exit is settled
+            final_balance = np.nan
+            heapq.heappush(pending, (times[exit_idx], s, trade))
+            next_row[s] = exit_idx + 1
+        positions += 1
+
+        columns["entry_idx"].append(entry)
+        columns["exit_idx"].append(exit_idx)
+        columns["entry_time"].append(times[entry])
+        columns["exit_time"].append(NAT if is_open else times[exit_idx])
+        columns["entry_price"].append(entry_price)
+        columns["exit_price"].append(exit_price)
+        columns["qty"].append(qty)
+        columns["side"].append(sign)
+        columns["tp_price"].append(tp_price)
+        columns["sl_price"].append(sl_price)
+        columns["lended_qty"].append(lended_qty)
+        columns["pnl"].append(pnl)
+        columns["starting_balance"].append(starting_balance)
+        columns["final_balance"].append(final_balance)
+        columns["open"].append(is_open)
+        columns["margin"].append(margin)
+        columns["symbol"].append(s)
+
+    while pending:
+        _, _, trade = heapq.heappop(pending)
+        realized += columns["pnl"][trade]
+        in_use -= columns["margin"][trade]
+        columns["final_balance"][trade] = realized - in_use
+
+    return {
+        name: np.asarray(values, dtype=PORTFOLIO_COLUMNS[name])
+        for name, values in columns.items()
+    }
+
+
+def portfolio_equity(arrays, trades, balance):
+    # Mark-to-market equity of the shared balance on the union of all the
+    # symbols' candle times: free balance plus the margin and unrealized pnl
+    # of every open position at the last close of its symbol. Returns
+    # (times, equity, in_position).
+    symbols = sorted(arrays)
+    times = np.unique(np.concatenate([arrays[symbol][2] for symbol in symbols]))
+
+    # Free balance: margin out at the entry, margin and pnl back at the exit
+    closed = ~trades["open"]
+    changes = np.zeros(len(times))
+    np.add.at(changes, times.searchsorted(trades["entry_time"]), -trades["margin"])
+    np.add.at(
+        changes,
+        times.searchsorted(trades["exit_time"][closed]),
+        trades["margin"][closed] + trades["pnl"][closed],
+    )
+    equity = balance + np.cumsum(changes)
+    positions = np.zeros(len(times), dtype=np.int64)
+
+    # A symbol's positions never overlap, so each one is a single pass over
+    # its candles
+    order = np.argsort(trades["symbol"], kind="stable")
+    bounds = trades["symbol"][order].searchsorted(np.arange(len(symbols) + 1))
+    for s, symbol in enumerate(symbols):
+        mine = order[bounds[s]: bounds[s + 1]]
+        if len(mine) == 0:
+            continue
+        close, _, symbol_times = arrays[symbol]
+        entry = trades["entry_idx"][mine]
+        # Last candle of each position, the exit one counted as in position
+        # like Metrics does for exposure
+        end = np.where(trades["open"][mine], len(close) - 1, trades["exit_idx"][mine])
+        bar = np.arange(len(close))
+        k = np.maximum(entry.searchsorted(bar, "right") - 1, 0)
+        held = (bar >= entry[k]) & (bar <= end[k])
+        # The exit candle is already settled in the free balance
+        valued = held & ((bar < end[k]) | trades["open"][mine][k])
+        k = mine[k]
+        value = np.where(
+            valued,
+            trades["margin"][k]
+            + trades["side"][k]
+            * (close - trades["entry_price"][k])
+            * trades["lended_qty"][k],
+            0,
+        )
+        # Last candle of the symbol at or before every portfolio time
+        at = symbol_times.searchsorted(times, "right") - 1
+        seen = at >= 0
+        equity[seen] += value[at[seen]]
+        positions[seen] += held[at[seen]]
+    return times, equity, positions > 0
@@ -0,0 +1,148 @@
+import heapq
+import itertools
+import threading
+from collections import defaultdict, deque
+from time import time, perf_counter
+from requests.adapters import HTTPAdapter
+
+# Binance Futures IP limit (request weight per minute)
+WEIGHT_LIMIT = 2400
+# Weight only orders may use, so market data and account polling can never
+# starve an entry or its SL/TP
+ORDER_RESERVE = 300
+# Requests in flight at once, also the size of the keep-alive pool
+POOL_SIZE = 10
+
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+
+
+class RequestScheduler:
+    # Every REST call goes through run(): callers wait in a priority queue
+    # (orders first, then account, then market data) until the minute's
+    # weight budget and the connection pool have room. The used weight is
+    # corrected from the X-MBX-USED-WEIGHT-1M header of each response.
+
+    def __init__(
+        self,
+        weight_limit=WEIGHT_LIMIT,
+        order_reserve=ORDER_RESERVE,
+        max_in_flight=POOL_SIZE,
+    ):
+        self.weight_limit = weight_limit
+        self.order_reserve = order_reserve
+        self.max_in_flight = max_in_flight
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.tickets = itertools.count()
+        self.minute = int(time() // 60)
+        self.used = 0
+        self.resume_at = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.calls = defaultdict(int)
+        self.latencies = defaultdict(lambda: deque(maxlen=1000))
+
+    def _roll(self):
+        minute = int(time() // 60)
+        if minute != self.minute:
+            self.minute = minute
+            self.used = 0
+
+    def _wait_time(self, priority, weight):
+        # 0 when the call can go now, None to wait for a release, otherwise
+        # seconds until the budget frees up
+        now = time()
+        if now < self.resume_at:
+            return self.resume_at - now
+        limit = self.weight_limit
+        if priority != PRIORITY_ORDER:
+            limit -= self.order_reserve
+        if self.used + weight > limit:
+            return (self.minute + 1) * 60 - now
+        if self.in_flight >= self.max_in_flight:
+            return None
+        return 0
+
+    def acquire(self, priority, weight):
+        with self.cond:
+            ticket = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiting))
+            while True:
+                self._roll()
+                wait = self._wait_time(priority, weight)
+                if self.waiting[0] == ticket and wait == 0:
+                    heapq.heappop(self.waiting)
+                    self.used += weight
+                    self.in_flight += 1
+                    self.cond.notify_all()
+                    return
+                self.cond.wait(timeout=wait or None)
+
+    def release(self, name, started):
+        with self.cond:
+            self.in_flight -= 1
+            self.calls[name] += 1
+            self.latencies[name].append((perf_counter() - started) * 1000)
+            self.cond.notify_all()
+
+    def run(self, name, priority, weight, func, *args, **kwargs):
+        self.acquire(priority, weight)
+        started = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.release(name, started)
+
+    def pause(self, seconds):
+        with self.cond:
+            self.resume_at = max(self.resume_at, time() + seconds)
+            self.cond.notify_all()
+
+    def on_response(self, response, *args, **kwargs):
+        # requests response hook, sees every call including the pages of
+        # futures_historical_klines
+        self.observe(response.status_code, response.headers)
+        return response
+
+    def observe(self, status, headers):
+        # Used weight and 429/418 pauses from any response, also the
+        # downloader's aiohttp ones
+        used = headers.get("X-MBX-USED-WEIGHT-1M")
+        if used is not None:
+            with self.cond:
+                self._roll()
+                self.used = max(self.used, int(used))
+        if status in (418, 429):
+            retry = int(headers.get("Retry-After", 60))
+            print(f"Rate limited ({status}), pausing {retry}s")
+            self.pause(retry)
+
+    def mount(self, session):
+        # One keep-alive pool shared by every thread using the client
+        adapter = HTTPAdapter(
+            pool_connections=self.max_in_flight, pool_maxsize=self.max_in_flight
+        )
+        session.mount("https://", adapter)
+        session.hooks["response"].append(self.on_response)
+
+    def stats(self):
+        with self.cond:
+            latency = {
+                name: {
+                    "calls": self.calls[name],
+                    "avg_ms": sum(values) / len(values),
+                    "max_ms": max(values),
+                }
+                for name, values in self.latencies.items()
+                if values
+            }
+            return {
+                "used_weight": self.used,
+                "queue_depth": len(self.waiting),
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "latency": latency,
+            }
@@ -0,0 +1,132 @@
+import threading
+import numpy as np
+import pandas as pd
+from indicators import OHLCV
+
+
+def timeframe_ns(timeframe):
+    return int(pd.Timedelta(timeframe).value)
+
+
+def _empty():
+    columns = {"Time": np.empty(0, dtype=np.int64)}
+    columns.update({name: np.empty(0) for name in OHLCV})
+    return columns
+
+
+def resample_ohlcv(kl, step, base_step):
+    # Candles of `step` ns out of base candles of `base_step` ns, bucket
+    # starts aligned to the epoch like Binance's (4h at 00/04/.. UTC, 1d at
+    # midnight). The last bucket is left out until its last base candle is
+    # there; returns the columns and the rows used, so the next call can
+    # start from the first unfinished bucket.
+    times = kl.index.values.astype("datetime64[ns]").view(np.int64)
+    if len(times) == 0:
+        return _empty(), 0
+    buckets = times - times % step
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    used = len(times)
+    if times[-1] < buckets[-1] + step - base_step:
+        used = starts[-1]
+        starts = starts[:-1]
+    if len(starts) == 0:
+        return _empty(), 0
+    ends = np.append(starts[1:], used) - 1
+    values = {name: kl[name].to_numpy(dtype=np.float64)[:used] for name in OHLCV}
+    columns = {
+        "Time": buckets[starts],
+        "Open": values["Open"][starts],
+        "High": np.maximum.reduceat(values["High"], starts),
+        "Low": np.minimum.reduceat(values["Low"], starts),
+        "Close": values["Close"][ends],
+        "Volume": np.add.reduceat(values["Volume"], starts),
+    }
+    return columns, used
+
+
+class ResampledStore:
+    # Only `base_timeframe` candles are stored, as plain OHLCV. Any other
+    # timeframe is aggregated from them when loaded and kept in memory; later
+    # loads only aggregate the base candles stored since. Indicators for the
+    # resampled frames come from the indicator cache.
+
+    def __init__(self, base, base_timeframe="1m"):
+        self.base = base
+        self.base_timeframe = base_timeframe
+        self.frames = dict()
+        self.lock = threading.Lock()
+
+    def exists(self, symbol, timeframe):
+        return self.base.exists(symbol, self.base_timeframe)
+
+    def mtime(self, symbol, timeframe):
+        return self.base.mtime(symbol, self.base_timeframe)
+
+    def length(self, symbol, timeframe):
+        if timeframe == self.base_timeframe:
+            return self.base.length(symbol, timeframe)
+        return len(self.resampled(symbol, timeframe)["Time"])
+
+    def columns(self, symbol, timeframe):
+        if timeframe == self.base_timeframe:
+            return self.base.columns(symbol, timeframe)
+        return list(OHLCV)
+
+    def load(self, symbol, timeframe, columns=None, tail=None):
+        if timeframe == self.base_timeframe:
+            return self.base.load(symbol, timeframe, columns, tail)
+        frame = self.resampled(symbol, timeframe)
+        start = 0 if tail is None else max(0, len(frame["Time"]) - tail)
+        names = OHLCV if columns is None else columns
+        index = pd.DatetimeIndex(
+            frame["Time"][start:].view("datetime64[ns]"), name="Time"
+        )
+        return pd.DataFrame(
+            {name: frame[name][start:] for name in names}, index=index
+        )
+
+    def resampled(self, symbol, timeframe):
+        step = timeframe_ns(timeframe)
+        base_step = timeframe_ns(self.base_timeframe)
+        if step <= base_step or step % base_step:
+            raise ValueError(
+                f"{timeframe} can not be built from {self.base_timeframe} candles"
+            )
+        with self.lock:
+            entry = self.frames.get((symbol, timeframe))
+            length = self.base.length(symbol, self.base_timeframe)
+            if entry is None or length < entry["length"]:
+                # First load, or the base history was rewritten
+                entry = {"length": 0, "used": 0, "columns": _empty()}
+                self.frames[(symbol, timeframe)] = entry
+            if length > entry["length"]:
+                # Base candles from the first unfinished bucket on
+                rows = self.base.load(
+                    symbol,
+                    self.base_timeframe,
+                    columns=OHLCV,
+                    tail=length - entry["used"],
+                )
+                added, used = resample_ohlcv(rows, step, base_step)
+                entry["columns"] = {
+                    name: np.concatenate((values, added[name]))
+                    for name, values in entry["columns"].items()
+                }
+                entry["used"] += used
+                entry["length"] = length
+            return entry["columns"]
+
+    def save(self, symbol, timeframe, kl):
+        self._check_base(timeframe)
+        self.base.save(symbol, timeframe, kl)
+
+    def append(self, symbol, timeframe, kl):
+        self._check_base(timeframe)
+        self.base.append(symbol, timeframe, kl)
+
+    def _check_base(self, timeframe):
+        if timeframe != self.base_timeframe:
+            raise ValueError(
+                f"Only {self.base_timeframe} candles are stored, "
+                f"{timeframe} is resampled from them"
+            )
@@ -0,0 +1,104 @@
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+from backtest import iso_dates, trades_to_records
+
+# Binary backtest results: MAGIC, the header size (uint32), a JSON header
+# with metrics/config and the column layout, then every trade column as raw
+# little endian values starting on an ALIGN byte boundary
+MAGIC = b"BTRES001"
+ALIGN = 64
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def write_results(path, trades, meta):
+    # trades: the column dict returned by backtest.run_backtest
+    columns = {}
+    for name, values in trades.items():
+        values = np.asarray(values)
+        columns[name] = np.ascontiguousarray(
+            values, dtype=values.dtype.newbyteorder("<")
+        )
+    length = len(next(iter(columns.values()))) if columns else 0
+    layout = {}
+    offset = 0
+    for name, values in columns.items():
+        layout[name] = {"dtype": values.dtype.str, "offset": offset}
+        offset = _aligned(offset + values.nbytes)
+    header = json.dumps({**meta, "length": length, "columns": layout}).encode()
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    # Written aside and renamed, a reader never sees half a file
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for name, values in columns.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(values.tobytes())
+    os.replace(f"{path}.tmp", path)
+
+
+def read_results(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a backtest results file")
+        (size,) = struct.unpack("<I", f.read(4))
+        result = json.loads(f.read(size))
+    data_start = _aligned(len(MAGIC) + 4 + size)
+
+    # Columns are read-only views on the memory-mapped file, nothing is
+    # parsed or copied until a value is used
+    length = result.pop("length")
+    layout = result.pop("columns")
+    buffer = np.memmap(path, dtype=np.uint8, mode="r") if length else None
+    trades = {}
+    for name, column in layout.items():
+        dtype = np.dtype(column["dtype"])
+        if length == 0:
+            trades[name] = np.empty(0, dtype=dtype)
+            continue
+        start = data_start + column["offset"]
+        trades[name] = buffer[start: start + length * dtype.itemsize].view(dtype)
+    result["trades"] = trades
+    return result
+
+
+def trades_frame(trades):
+    # The trade columns under the names of the JSON records, dates as
+    # datetimes (NaT exit for a still open trade)
+    return pd.DataFrame(
+        {
+            "entry_date": trades["entry_time"].view("datetime64[ns]"),
+            "exit_date": trades["exit_time"].view("datetime64[ns]"),
+            "entry_price": trades["entry_price"],
+            "exit_price": trades["exit_price"],
+            "qty": trades["qty"],
+            "sign": np.where(trades["side"] == 1, "buy", "sell"),
+            "tp_price": trades["tp_price"],
+            "sl_price": trades["sl_price"],
+            "starting_balance": trades["starting_balance"],
+            "lended_qty": trades["lended_qty"],
+            "pnl": trades["pnl"],
+            "final_balance": trades["final_balance"],
+        }
+    )
+
+
+def export_json(path, json_path):
+    # Same layout as the old results files: a list of trades, ISO dates
+    result = read_results(path)
+    trades = iso_dates(trades_to_records(result.pop("trades")))
+    result = {
+        "metrics": result.pop("metrics"),
+        "trades": trades,
+        "config": result.pop("config"),
+        **result,
+    }
+    with open(json_path, "w") as f:
+        json.dump(result, f, indent=4)
@@ -0,0 +1,185 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+class CsvStore:
+    # Original layout: one data/{symbol}-{timeframe}.csv per pair
+
+    def __init__(self, path="data"):
+        self.path = path
+
+    def file(self, symbol, timeframe):
+        return os.path.join(self.path, f"{symbol}-{timeframe}.csv")
+
+    def exists(self, symbol, timeframe):
+        return os.path.exists(self.file(symbol, timeframe))
+
+    def mtime(self, symbol, timeframe):
+        return os.path.getmtime(self.file(symbol, timeframe))
+
+    def columns(self, symbol, timeframe):
+        return list(pd.read_csv(self.file(symbol, timeframe), nrows=0).columns[1:])
+
+    def length(self, symbol, timeframe):
+        return len(pd.read_csv(self.file(symbol, timeframe), usecols=["Time"]))
+
+    def load(self, symbol, timeframe, columns=None, tail=None):
+        usecols = None if columns is None else ["Time"] + list(columns)
+        kl = pd.read_csv(self.file(symbol, timeframe), usecols=usecols)
+        if tail is not None:
+            kl = kl.tail(tail)
+        kl["Time"] = pd.to_datetime(kl["Time"])
+        kl.set_index("Time", inplace=True)
+        return kl
+
+    def save(self, symbol, timeframe, kl):
+        kl.to_csv(self.file(symbol, timeframe), index_label="Time")
+
+    def append(self, symbol, timeframe, kl):
+        if not self.exists(symbol, timeframe):
+            return self.save(symbol, timeframe, kl)
+        kl.to_csv(
+            self.file(symbol, timeframe), mode="a", header=False, index_label="Time"
+        )
+
+
+class NpyStore:
+    # One raw binary file per column under data/{symbol}-{timeframe}/, plus a
+    # meta.json with the column dtypes. Columns are memory-mapped, so a load
+    # only touches the rows and columns it asks for.
+
+    def __init__(self, path="data"):
+        self.path = path
+
+    def directory(self, symbol, timeframe):
+        return os.path.join(self.path, f"{symbol}-{timeframe}")
+
+    def meta_file(self, symbol, timeframe):
+        # A pair only stored as data/{symbol}-{timeframe}.csv (CsvStore) is
+        # migrated the first time it is used, so switching STORAGE does not
+        # hide the existing history
+        path = os.path.join(self.directory(symbol, timeframe), "meta.json")
+        if not os.path.exists(path):
+            source = CsvStore(self.path)
+            if source.exists(symbol, timeframe):
+                print(f"Migrating {symbol}-{timeframe} to npy...")
+                self.save(symbol, timeframe, source.load(symbol, timeframe))
+        return path
+
+    def exists(self, symbol, timeframe):
+        return os.path.exists(self.meta_file(symbol, timeframe))
+
+    def mtime(self, symbol, timeframe):
+        # meta.json is rewritten last by save and append
+        return os.path.getmtime(self.meta_file(symbol, timeframe))
+
+    def read_meta(self, symbol, timeframe):
+        with open(self.meta_file(symbol, timeframe)) as f:
+            return json.load(f)
+
+    def write_meta(self, symbol, timeframe, meta):
+        path = os.path.join(self.directory(symbol, timeframe), "meta.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp", path)
+
+    def columns(self, symbol, timeframe):
+        return [
+            name
+            for name in self.read_meta(symbol, timeframe)["columns"]
+            if name != "Time"
+        ]
+
+    def length(self, symbol, timeframe):
+        return self.read_meta(symbol, timeframe)["length"]
+
+    def column(self, symbol, timeframe, name, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        path = os.path.join(self.directory(symbol, timeframe), f"{name}.bin")
+        return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+    def load(self, symbol, timeframe, columns=None, tail=None):
+        meta = self.read_meta(symbol, timeframe)
+        length = meta["length"]
+        start = 0 if tail is None else max(0, length - tail)
+        names = list(meta["columns"]) if columns is None else list(columns)
+        time = self.column(symbol, timeframe, "Time", "int64", length)[start:]
+        data = {
+            name: np.array(
+                self.column(
+                    symbol, timeframe, name, meta["columns"][name], length
+                )[start:]
+            )
+            for name in names
+            if name != "Time"
+        }
+        index = pd.DatetimeIndex(
+            np.array(time).view("datetime64[ns]"), name="Time"
+        )
+        return pd.DataFrame(data, index=index)
+
+    def save(self, symbol, timeframe, kl):
+        directory = self.directory(symbol, timeframe)
+        os.makedirs(directory, exist_ok=True)
+        meta = {"columns": {"Time": "int64"}, "length": len(kl)}
+        self._write_column(directory, "Time", _time_values(kl), "wb")
+        for name in kl.columns:
+            values = kl[name].to_numpy(dtype=np.float64)
+            meta["columns"][name] = "float64"
+            self._write_column(directory, name, values, "wb")
+        self.write_meta(symbol, timeframe, meta)
+
+    def append(self, symbol, timeframe, kl):
+        if not self.exists(symbol, timeframe):
+            return self.save(symbol, timeframe, kl)
+        directory = self.directory(symbol, timeframe)
+        meta = self.read_meta(symbol, timeframe)
+        if set(kl.columns) | {"Time"} != set(meta["columns"]):
+            raise ValueError(
+                f"Columns {list(kl.columns)} do not match stored "
+                f"{list(meta['columns'])} for {symbol}-{timeframe}"
+            )
+        # Drop anything past the committed length (an interrupted append)
+        # before writing, then publish the new length in meta.json last
+        for name, dtype in meta["columns"].items():
+            path = os.path.join(directory, f"{name}.bin")
+            with open(path, "r+b") as f:
+                f.truncate(meta["length"] * np.dtype(dtype).itemsize)
+        self._write_column(directory, "Time", _time_values(kl), "ab")
+        for name in kl.columns:
+            self._write_column(
+                directory, name, kl[name].to_numpy(dtype=np.float64), "ab"
+            )
+        meta["length"] += len(kl)
+        self.write_meta(symbol, timeframe, meta)
+
+    def _write_column(self, directory, name, values, mode):
+        with open(os.path.join(directory, f"{name}.bin"), mode) as f:
+            f.write(np.ascontiguousarray(values).tobytes())
+
+
+def _time_values(kl):
+    return kl.index.values.astype("datetime64[ns]").view(np.int64)
+
+
+STORES = {
+    "csv": CsvStore,
+    "npy": NpyStore,
+}
+
+
+def get_store(kind, path="data"):
+    return STORES[kind](path)
+
+
+def migrate_csv(symbols, timeframe, path="data", kind="npy"):
+    source = CsvStore(path)
+    target = get_store(kind, path)
+    for symbol in symbols:
+        if not source.exists(symbol, timeframe):
+            print(f"No CSV for {symbol}-{timeframe}, skipping")
+            continue
+        print(f"Migrating {symbol}-{timeframe} to {kind}...")
+        target.save(symbol, timeframe, source.load(symbol, timeframe))
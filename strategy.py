@@ -1,15 +1,77 @@
-class Strategy:
+import numpy as np
+from indicators import EMA_WINDOW, RSI_WINDOW
+
+
+# StochRSI levels of the entry rules, on the 0..1 scale stoch_rsi is stored
+# in (ta's stochrsi), like utils.WF_OVERSOLD_GRID / WF_OVERBOUGHT_GRID
+OVERSOLD = 0.2
+OVERBOUGHT = 0.8
+
+
+class BaseStrategy:
+    # What a strategy plugs into the bot: the indicator columns it reads and
+    # the parameters they are computed with (see indicators.REGISTRY, any
+    # "ema_<window>" works too). Backtests and the live loop only compute
+    # those columns.
+    indicators = []
+    params = {}
 
     def get_signal(self, data):
-        if (
-            data.stoch_rsi.iloc[-1] <= 20
-            and data.ema_200.iloc[-1] < data.Close.iloc[-1]
-        ):
+        return self.evaluate(data.iloc[-1])
+
+    def evaluate(self, values):
+        # Latest values only, used with streaming.IndicatorStream.values()
+        raise NotImplementedError
+
+    def get_signals(self, data):
+        # Every row at once: (signals, signal_prices) arrays
+        raise NotImplementedError
+
+
+class Strategy(BaseStrategy):
+
+    def __init__(
+        self,
+        oversold=OVERSOLD,
+        overbought=OVERBOUGHT,
+        rsi_window=RSI_WINDOW,
+        ema_window=EMA_WINDOW,
+    ):
+        self.oversold = oversold
+        self.overbought = overbought
+        self.ema = f"ema_{ema_window}"
+        self.indicators = ["stoch_rsi", self.ema]
+        self.params = {"rsi_window": rsi_window}
+
+    def evaluate(self, values):
+        close = values["Close"]
+        stoch_rsi = values["stoch_rsi"]
+        ema = values[self.ema]
+        if stoch_rsi <= self.oversold and ema < close:
             return "buy"
-        elif (
-            data.stoch_rsi.iloc[-1] >= 80
-            and data.ema_200.iloc[-1] > data.Close.iloc[-1]
-        ):
+        elif stoch_rsi >= self.overbought and ema > close:
             return "sell"
         else:
             return "hold"
+
+    def get_signals(self, data):
+        # Same rules as evaluate, on every row at once
+        stoch_rsi = data.stoch_rsi.to_numpy(dtype=float)
+        ema = data[self.ema].to_numpy(dtype=float)
+        close = data.Close.to_numpy(dtype=float)
+
+        buy = (stoch_rsi <= self.oversold) & (ema < close)
+        sell = (stoch_rsi >= self.overbought) & (ema > close)
+
+        signals = np.where(buy, "buy", np.where(sell, "sell", "hold"))
+        signal_prices = np.where(signals != "hold", close, np.nan)
+        return signals.astype(object), signal_prices
+
+
+STRATEGIES = {
+    "stoch_rsi_ema": Strategy,
+}
+
+
+def get_strategy(kind, **params):
+    return STRATEGIES[kind](**params)
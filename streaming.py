@@ -0,0 +1,322 @@
+import math
+from collections import deque
+from indicators import (
+    MACD_FAST,
+    MACD_SLOW,
+    MACD_SIGN,
+    RSI_WINDOW,
+    STOCH_SMOOTH,
+    BB_WINDOW,
+    BB_DEV,
+    ADX_WINDOW,
+    DEFAULT_PARAMS,
+    INDICATOR_COLUMNS,
+    ema_window,
+)
+
+NAN = float("nan")
+
+
+def _window_mean(values, size):
+    if len(values) < size or any(math.isnan(v) for v in values):
+        return NAN
+    return sum(values) / size
+
+
+class EMA:
+    # adjust=False ewm, same recursion (and rounding) as pandas/ta
+
+    def __init__(self, window=None, alpha=None):
+        self.window = window
+        self.alpha = alpha if alpha is not None else 2 / (window + 1)
+        self.value = None
+        self.count = 0
+
+    def update(self, x):
+        if math.isnan(x):
+            return self.current()
+        if self.value is None:
+            self.value = x
+        else:
+            old_wt = 1 - self.alpha
+            self.value = (old_wt * self.value + self.alpha * x) / (
+                old_wt + self.alpha
+            )
+        self.count += 1
+        return self.current()
+
+    def current(self):
+        if self.value is None or self.count < self.window:
+            return NAN
+        return self.value
+
+
+class RSI:
+
+    def __init__(self, window=RSI_WINDOW):
+        self.up = EMA(window, alpha=1 / window)
+        self.down = EMA(window, alpha=1 / window)
+        self.prev_close = None
+        self.value = NAN
+
+    def update(self, close):
+        diff = NAN if self.prev_close is None else close - self.prev_close
+        self.prev_close = close
+        up = self.up.update(diff if diff > 0 else 0.0)
+        down = self.down.update(-diff if diff < 0 else 0.0)
+        if math.isnan(up) or math.isnan(down):
+            self.value = NAN
+        elif down == 0:
+            self.value = 100.0
+        else:
+            self.value = 100 - (100 / (1 + up / down))
+        return self.value
+
+
+class StochRSI:
+
+    def __init__(self, window=RSI_WINDOW, smooth1=STOCH_SMOOTH, smooth2=STOCH_SMOOTH):
+        self.rsi = RSI(window)
+        self.rsis = deque(maxlen=window)
+        self.stochs = deque(maxlen=smooth1)
+        self.ks = deque(maxlen=smooth2)
+        self.value = self.k = self.d = NAN
+
+    def update(self, close):
+        self.rsis.append(self.rsi.update(close))
+        if len(self.rsis) < self.rsis.maxlen or any(math.isnan(v) for v in self.rsis):
+            self.value = NAN
+        else:
+            lowest = min(self.rsis)
+            highest = max(self.rsis)
+            # 0/0 is NaN in pandas, keep that instead of raising
+            self.value = (
+                (self.rsis[-1] - lowest) / (highest - lowest)
+                if highest != lowest
+                else NAN
+            )
+        self.stochs.append(self.value)
+        self.k = _window_mean(self.stochs, self.stochs.maxlen)
+        self.ks.append(self.k)
+        self.d = _window_mean(self.ks, self.ks.maxlen)
+        return self.value
+
+
+class MACD:
+
+    def __init__(self, fast=MACD_FAST, slow=MACD_SLOW, sign=MACD_SIGN):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal_ema = EMA(sign)
+        self.value = self.signal = self.diff = NAN
+
+    def update(self, close):
+        self.value = self.fast.update(close) - self.slow.update(close)
+        self.signal = self.signal_ema.update(self.value)
+        self.diff = self.value - self.signal
+        return self.value
+
+
+class BollingerBands:
+
+    def __init__(self, window=BB_WINDOW, window_dev=BB_DEV):
+        self.closes = deque(maxlen=window)
+        self.window_dev = window_dev
+        self.mid = self.upper = self.lower = NAN
+
+    def update(self, close):
+        self.closes.append(close)
+        if len(self.closes) < self.closes.maxlen:
+            return self.mid
+        n = len(self.closes)
+        self.mid = sum(self.closes) / n
+        std = math.sqrt(sum((c - self.mid) ** 2 for c in self.closes) / n)
+        self.upper = self.mid + self.window_dev * std
+        self.lower = self.mid - self.window_dev * std
+        return self.mid
+
+
+class ADX:
+    # Follows ta's ADXIndicator, which reports 0 until 2 * window - 1 rows
+
+    def __init__(self, window=ADX_WINDOW):
+        self.window = window
+        self.prev = None
+        self.count = 0
+        self.trs = self.dip = self.din = 0.0
+        self.dxs = []
+        self.value = 0.0
+
+    def update(self, high, low, close):
+        if self.prev is None:
+            self.prev = (high, low, close)
+            return self.value
+        prev_high, prev_low, prev_close = self.prev
+        self.prev = (high, low, close)
+        self.count += 1
+        w = self.window
+
+        tr = max(high, prev_close) - min(low, prev_close)
+        diff_up = high - prev_high
+        diff_down = prev_low - low
+        pos = diff_up if diff_up > diff_down and diff_up > 0 else 0.0
+        neg = diff_down if diff_down > diff_up and diff_down > 0 else 0.0
+
+        if self.count <= w:
+            # Plain sums over the first window
+            self.trs += tr
+            self.dip += pos
+            self.din += neg
+            if self.count < w:
+                return self.value
+        else:
+            self.trs = self.trs - (self.trs / float(w)) + tr
+            self.dip = self.dip - (self.dip / float(w)) + pos
+            self.din = self.din - (self.din / float(w)) + neg
+
+        dx = self.directional_index()
+        if len(self.dxs) < w:
+            self.dxs.append(dx)
+            if len(self.dxs) == w:
+                self.value = sum(self.dxs) / w
+        else:
+            self.value = ((self.value * (w - 1)) + dx) / float(w)
+        return self.value
+
+    def directional_index(self):
+        di_pos = 100 * (self.dip / self.trs) if self.trs != 0 else 0
+        di_neg = 100 * (self.din / self.trs) if self.trs != 0 else 0
+        if di_pos + di_neg != 0:
+            return 100 * abs((di_pos - di_neg) / (di_pos + di_neg))
+        return 0
+
+
+MACD_COLUMNS = {"macd", "macd_diff", "macd_signal"}
+STOCH_COLUMNS = {"stoch_rsi", "stoch_rsi_k", "stoch_rsi_d"}
+BB_COLUMNS = {"bb_upper", "bb_lower", "bb_mid"}
+
+
+class IndicatorStream:
+    # Streaming versions of the requested indicator columns (the whole
+    # add_indicators set by default) for one symbol, updated one candle at a
+    # time. Indicators nobody asked for are not kept at all.
+
+    def __init__(self, columns=INDICATOR_COLUMNS, params=None):
+        params = {**DEFAULT_PARAMS, **(params or {})}
+        wanted = set(columns)
+        self.macd = self.stoch_rsi = self.rsi = self.bollinger = self.adx = None
+        if wanted & MACD_COLUMNS:
+            self.macd = MACD(
+                params["macd_fast"], params["macd_slow"], params["macd_sign"]
+            )
+        if wanted & STOCH_COLUMNS:
+            self.stoch_rsi = StochRSI(
+                params["rsi_window"], params["stoch_smooth"], params["stoch_smooth"]
+            )
+            # The Stoch RSI runs its own RSI, shared with the rsi column
+            self.rsi = self.stoch_rsi.rsi
+        elif "rsi" in wanted:
+            self.rsi = RSI(params["rsi_window"])
+        if wanted & BB_COLUMNS:
+            self.bollinger = BollingerBands(params["bb_window"], params["bb_dev"])
+        self.emas = {
+            name: EMA(ema_window(name)) for name in columns if ema_window(name)
+        }
+        if "adx" in wanted:
+            self.adx = ADX(params["adx_window"])
+        self.time = None
+        self.close = NAN
+
+    @classmethod
+    def from_history(cls, kl, columns=INDICATOR_COLUMNS, params=None):
+        stream = cls(columns, params)
+        for row in zip(kl.index, kl.High, kl.Low, kl.Close):
+            stream.update(*row)
+        return stream
+
+    @classmethod
+    def from_state(cls, history, state, columns=INDICATOR_COLUMNS):
+        # Seed from the extract_data state file (indicators.indicator_state)
+        # and the last stored rows, without replaying the history. Only for
+        # stored columns with the default params (indicators.stored_defaults)
+        stream = cls(columns)
+        warm = 10 ** 9
+        last = history.iloc[-1]
+        if stream.macd is not None:
+            stream.macd.fast.value, stream.macd.fast.count = state["ema_fast"], warm
+            stream.macd.slow.value, stream.macd.slow.count = state["ema_slow"], warm
+            stream.macd.signal_ema.value = state["macd_signal"]
+            stream.macd.signal_ema.count = warm
+            stream.macd.value = float(last.macd)
+            stream.macd.signal = float(last.macd_signal)
+            stream.macd.diff = float(last.macd_diff)
+        if stream.rsi is not None:
+            rsi = stream.rsi
+            rsi.up.value, rsi.up.count = state["rsi_up"], warm
+            rsi.down.value, rsi.down.count = state["rsi_down"], warm
+            rsi.prev_close = float(history.Close.iloc[-1])
+            rsi.value = float(last.rsi)
+        if stream.stoch_rsi is not None:
+            stream.stoch_rsi.rsis.extend(history.rsi.tolist())
+            stream.stoch_rsi.stochs.extend(history.stoch_rsi.tolist())
+            stream.stoch_rsi.ks.extend(history.stoch_rsi_k.tolist())
+            stream.stoch_rsi.value = float(last.stoch_rsi)
+            stream.stoch_rsi.k = float(last.stoch_rsi_k)
+            stream.stoch_rsi.d = float(last.stoch_rsi_d)
+        if stream.bollinger is not None:
+            stream.bollinger.closes.extend(history.Close.tolist())
+            stream.bollinger.mid = float(last.bb_mid)
+            stream.bollinger.upper = float(last.bb_upper)
+            stream.bollinger.lower = float(last.bb_lower)
+        for name, ema in stream.emas.items():
+            ema.value, ema.count = state[name], warm
+        if stream.adx is not None:
+            stream.adx.trs = state["adx"]["trs"]
+            stream.adx.dip = state["adx"]["dip"]
+            stream.adx.din = state["adx"]["din"]
+            stream.adx.value = state["adx"]["adx"]
+            stream.adx.count = warm
+            stream.adx.dxs = [0] * stream.adx.window
+            stream.adx.prev = (float(last.High), float(last.Low), float(last.Close))
+        stream.time = history.index[-1]
+        stream.close = float(last.Close)
+        return stream
+
+    def update(self, time, high, low, close):
+        if self.macd is not None:
+            self.macd.update(close)
+        if self.stoch_rsi is not None:
+            self.stoch_rsi.update(close)
+        elif self.rsi is not None:
+            self.rsi.update(close)
+        if self.bollinger is not None:
+            self.bollinger.update(close)
+        for ema in self.emas.values():
+            ema.update(close)
+        if self.adx is not None:
+            self.adx.update(high, low, close)
+        self.time = time
+        self.close = close
+        return self.values()
+
+    def values(self):
+        values = {"Close": self.close}
+        if self.macd is not None:
+            values["macd"] = self.macd.value
+            values["macd_diff"] = self.macd.diff
+            values["macd_signal"] = self.macd.signal
+        if self.rsi is not None:
+            values["rsi"] = self.rsi.value
+        if self.stoch_rsi is not None:
+            values["stoch_rsi"] = self.stoch_rsi.value
+            values["stoch_rsi_k"] = self.stoch_rsi.k
+            values["stoch_rsi_d"] = self.stoch_rsi.d
+        if self.bollinger is not None:
+            values["bb_upper"] = self.bollinger.upper
+            values["bb_lower"] = self.bollinger.lower
+            values["bb_mid"] = self.bollinger.mid
+        for name, ema in self.emas.items():
+            values[name] = ema.current()
+        if self.adx is not None:
+            values["adx"] = self.adx.value
+        return values
@@ -0,0 +1,105 @@
+import itertools
+from collections import defaultdict
+import os
+import pandas as pd
+from backtest import frame_arrays, run_backtest
+from metrics import Metrics
+from montecarlo import monte_carlo
+from workers import shared, worker_pool
+
+
+def _run_combinations(combinations, balance, mc_runs=0, ruin=0.5):
+    metrics = Metrics()
+    rows = []
+    runs = defaultdict(list)
+    for symbol, tp, sl, leverage, risk_balance in combinations:
+        close, side, times = shared["arrays"][symbol]
+        trades = run_backtest(
+            close,
+            side,
+            times,
+            tp,
+            sl,
+            balance,
+            leverage,
+            risk_balance,
+            shared["exits"].get(symbol),
+        )
+        rows.append(
+            {
+                "symbol": symbol,
+                "tp": tp,
+                "sl": sl,
+                "leverage": leverage,
+                "risk_balance": risk_balance,
+                "trades": len(trades["pnl"]),
+            }
+        )
+        if mc_runs:
+            montecarlo = monte_carlo(trades["pnl"], balance, mc_runs, ruin=ruin)
+            if montecarlo is not None:
+                rows[-1]["mc_final_balance_p5"] = montecarlo["final_balance"]["p5"]
+                rows[-1]["mc_max_drawdown_p95"] = montecarlo["max_drawdown"]["p95"]
+                rows[-1]["mc_risk_of_ruin"] = montecarlo["risk_of_ruin"]
+        runs[symbol].append((len(rows) - 1, trades))
+
+    # Scored per symbol in one batch, all runs share the close series
+    for symbol, symbol_runs in runs.items():
+        close, _, times = shared["arrays"][symbol]
+        results = metrics.calculate_batch(
+            [trades for _, trades in symbol_runs], close, times, balance
+        )
+        for (row, _), result in zip(symbol_runs, results):
+            rows[row].update(result)
+    return rows
+
+
+def run_sweep(
+    klines,
+    balance,
+    tp_grid,
+    sl_grid,
+    leverage_grid,
+    risk_balance_grid,
+    workers=None,
+    mc_runs=0,
+    ruin=0.5,
+    exits=None,
+):
+    # klines already carry the signal column, so only the arrays (and the
+    # exit resolvers, symbol -> exits.ExitResolver) are shipped to the
+    # workers, once per process
+    arrays = {symbol: frame_arrays(kl) for symbol, kl in klines.items()}
+    combinations = list(
+        itertools.product(
+            arrays, tp_grid, sl_grid, leverage_grid, risk_balance_grid
+        )
+    )
+    workers = workers or os.cpu_count()
+    chunk_size = max(1, len(combinations) // (workers * 4))
+    chunks = [
+        combinations[i: i + chunk_size]
+        for i in range(0, len(combinations), chunk_size)
+    ]
+
+    rows = []
+    with worker_pool(workers, {"arrays": arrays, "exits": exits or {}}) as executor:
+        futures = [
+            executor.submit(_run_combinations, chunk, balance, mc_runs, ruin)
+            for chunk in chunks
+        ]
+        for done, future in enumerate(futures, start=1):
+            rows.extend(future.result())
+            print(f"Sweep chunk {done}/{len(chunks)} done")
+
+    results = pd.DataFrame(rows)
+    if len(results):
+        results = results.sort_values(
+            ["roi", "profit_factor"], ascending=False, kind="stable"
+        ).reset_index(drop=True)
+        results.insert(0, "rank", results.index + 1)
+    return results
+
+
+def write_sweep_results(results, path="results/sweep_results.csv"):
+    results.to_csv(path, index=False)
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+
+def make_klines(rows=600, seed=0, start="2024-01-01"):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, rows))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, rows))
+    index = pd.date_range(start, periods=rows, freq="1h", name="Time")
+    return pd.DataFrame(
+        {
+            "Open": open_,
+            "High": high,
+            "Low": low,
+            "Close": close,
+            "Volume": rng.uniform(1, 100, rows),
+        },
+        index=index,
+    )
@@ -0,0 +1,60 @@
+import pytest
+from binance.exceptions import BinanceAPIException
+
+from binance_integration import Binance
+
+
+def api_error(code, msg):
+    return BinanceAPIException(None, 400, f'{{"code": {code}, "msg": "{msg}"}}')
+
+
+class StubClient:
+    # Records the calls and raises the queued python-binance errors
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = []
+
+    def __getattr__(self, name):
+        def method(**kwargs):
+            self.calls.append(name)
+            if self.errors.get(name):
+                raise self.errors[name].pop(0)
+            return {}
+
+        return method
+
+
+def session_with(errors):
+    session = Binance("key", "secret")
+    session._client = StubClient(errors)
+    return session
+
+
+def test_set_mode_already_in_that_mode():
+    session = session_with(
+        {
+            "futures_change_margin_type": [
+                api_error(-4046, "No need to change margin type.")
+            ]
+        }
+    )
+    session.set_mode("BTCUSDT", "ISOLATED")
+    assert session.modes == {"BTCUSDT": "ISOLATED"}
+    # Cached, the second call does not reach the exchange
+    session.set_mode("BTCUSDT", "ISOLATED")
+    assert session._client.calls == ["futures_change_margin_type"]
+
+
+@pytest.mark.parametrize(
+    "name, change",
+    [
+        ("futures_change_margin_type", lambda s: s.set_mode("BTCUSDT", "ISOLATED")),
+        ("futures_change_leverage", lambda s: s.set_leverage("BTCUSDT", 10)),
+        ("futures_exchange_info", lambda s: s.get_symbol_info("BTCUSDT")),
+    ],
+)
+def test_api_errors_are_reported_not_raised(name, change, capsys):
+    session = session_with({name: [api_error(-1121, "Invalid symbol.")]})
+    change(session)
+    assert "-1121" in capsys.readouterr().out
+    assert session.modes == {} and session.leverages == {}
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import types
+
+import aiohttp
+import pandas as pd
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import downloader
+import utils
+from downloader import KlineDownloader, interval_ms
+from rate_limit import RequestScheduler
+from storage import CsvStore
+
+START = pd.Timestamp("2024-01-01")
+STEP = interval_ms("1h")
+
+
+def ms(hours):
+    return START.value // 1_000_000 + hours * STEP
+
+
+class FakeKlines:
+    # /fapi/v1/klines over candles closed before `now`, failing the chunks
+    # whose startTime is in `fail`
+    def __init__(self):
+        self.now = 0
+        self.fail = set()
+        self.requested = []
+
+    async def handle(self, request):
+        start = int(request.query["startTime"])
+        end = int(request.query["endTime"])
+        limit = int(request.query["limit"])
+        self.requested.append(start)
+        if start in self.fail:
+            # Late, so the other chunks of the run are saved first
+            await asyncio.sleep(0.2)
+            return web.json_response({"code": -1, "msg": "fail"}, status=400)
+        last = min(end, self.now - STEP)
+        klines = [
+            [t, str(t % 97), str(t % 97 + 2), str(t % 97 - 1), str(t % 97 + 1), "5"]
+            for t in range(start, last + 1, STEP)
+        ][:limit]
+        return web.json_response(klines, headers={"X-MBX-USED-WEIGHT-1M": "1"})
+
+
+async def download(server, downloader_):
+    downloader_.base_url = str(server.make_url("")).rstrip("/")
+    await downloader_.download(["BTCUSDT"], ["1h"], str(START))
+
+
+def test_download_resumes_from_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "DATA_PATH", str(tmp_path))
+    clock = types.SimpleNamespace(time=lambda: fake.now / 1000)
+    monkeypatch.setattr(downloader, "time", clock)
+    store = CsvStore(str(tmp_path))
+    checkpoints = str(tmp_path / ".download")
+    fake = FakeKlines()
+    scheduler = RequestScheduler()
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/fapi/v1/klines", fake.handle)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            # First run up to 95h, 10 candle chunks: the last one is partial
+            # and the one at 40h fails
+            fake.now = ms(95) + 1000
+            fake.fail = {ms(40)}
+            first = KlineDownloader(store, limit=10, checkpoint_path=checkpoints)
+            with pytest.raises(aiohttp.ClientResponseError):
+                await download(server, first)
+            directory = first.checkpoint_dir("BTCUSDT", "1h")
+            assert len(os.listdir(directory)) == 9
+            # A chunk left from an older range must not be merged
+            with open(os.path.join(directory, f"{ms(-10)}.json"), "w") as f:
+                json.dump([[ms(-10), "1", "1", "1", "1", "1"]], f)
+
+            # Resumed later, up to 130h
+            fake.now = ms(130) + 1000
+            fake.fail = set()
+            fake.requested = []
+            second = KlineDownloader(
+                store, limit=10, scheduler=scheduler, checkpoint_path=checkpoints
+            )
+            await download(server, second)
+        finally:
+            await server.close()
+
+    asyncio.run(scenario())
+
+    # Only the failed chunk, the partial one and the new ones were fetched
+    assert sorted(fake.requested) == [ms(h) for h in (40, 90, 100, 110, 120)]
+    # Counted by the scheduler shared with the REST client
+    assert scheduler.calls["futures_klines"] == 5
+    assert scheduler.in_flight == 0
+    kl = store.load("BTCUSDT", "1h")
+    expected = pd.date_range(START, periods=130, freq="1h")
+    assert (kl.index == expected).all()
+    closes = [float(ms(h) % 97 + 1) for h in range(130)]
+    assert (kl.Close.to_numpy() == closes).all()
+    assert not os.path.exists(checkpoints + "/BTCUSDT-1h")
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pytest
+from indicators import IndicatorFrame
+from indicator_cache import IndicatorCache
+from storage import get_store
+from klines import make_klines
+
+NAMES = ["stoch_rsi_k", "stoch_rsi_d", "bb_upper", "bb_lower", "ema_100", "adx"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return get_store("npy", str(tmp_path / "data"))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IndicatorCache(str(tmp_path / "data" / ".indicators"), max_bytes=2 ** 30)
+
+
+def assert_full_recompute(store, loaded, names, params=None):
+    kl = store.load("TEST", "1h")
+    frame = IndicatorFrame(kl, params)
+    assert len(loaded) == len(kl)
+    for name in names:
+        want = frame[name].to_numpy()
+        got = loaded[name].to_numpy()
+        np.testing.assert_array_equal(np.isnan(got), np.isnan(want), err_msg=name)
+        # Only the warmup tail is recomputed, which moves rounding a little
+        np.testing.assert_allclose(
+            got, want, rtol=1e-7, atol=1e-8, equal_nan=True, err_msg=name
+        )
+
+
+@pytest.mark.parametrize("params", [None, {"rsi_window": 21}])
+def test_extend_matches_full_recompute(store, cache, params):
+    kl = make_klines(3000)
+    store.save("TEST", "1h", kl.iloc[:2200])
+    cache.load(store, "TEST", "1h", NAMES, params)
+    assert cache.misses > 0 and cache.extends == 0
+
+    store.append("TEST", "1h", kl.iloc[2200:])
+    loaded = cache.load(store, "TEST", "1h", NAMES, params)
+    assert cache.extends > 0
+    assert_full_recompute(store, loaded, NAMES, params)
+
+    # Nothing new: read back as it is
+    hits = cache.hits
+    again = cache.load(store, "TEST", "1h", NAMES, params)
+    assert cache.hits > hits
+    for name in NAMES:
+        np.testing.assert_array_equal(again[name], loaded[name])
+
+
+def test_tail(store, cache):
+    store.save("TEST", "1h", make_klines(1000))
+    full = cache.load(store, "TEST", "1h", ["ema_100"])
+    tail = cache.load(store, "TEST", "1h", ["ema_100"], tail=100)
+    assert len(tail) == 100
+    np.testing.assert_array_equal(tail.ema_100, full.ema_100.iloc[-100:])
+
+
+def test_rewritten_history_is_recomputed(store, cache):
+    store.save("TEST", "1h", make_klines(1000, seed=1))
+    cache.load(store, "TEST", "1h", ["ema_100"])
+    # Same first candle, different data and length
+    store.save("TEST", "1h", make_klines(800, seed=2))
+    loaded = cache.load(store, "TEST", "1h", ["ema_100"])
+    assert_full_recompute(store, loaded, ["ema_100"])
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = IndicatorCache(str(tmp_path), max_bytes=2 ** 30)
+    values = np.zeros((1, 1000))
+    meta = {"length": 1000}
+    for key in ("a", "b", "c"):
+        cache.write(key, meta, values)
+    # a oldest, then b and c; reading a makes it the most recently used
+    for age, key in enumerate(("a", "b", "c")):
+        os.utime(cache.file(key), (1000 + age, 1000 + age))
+    cache.read("a")
+
+    size = os.path.getsize(cache.file("a"))
+    cache.max_bytes = 2 * size
+    cache.evict()
+    left = sorted(name for name in os.listdir(tmp_path))
+    assert left == ["a.json", "a.npy", "c.json", "c.npy"]
@@ -0,0 +1,111 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+from websockets.datastructures import Headers
+from websockets.http11 import Response
+
+import market_data
+from klines import make_klines
+from market_data import (
+    BinanceKlineSource,
+    MarketData,
+    ReplayKlineSource,
+    kline_message,
+)
+from storage import CsvStore
+
+
+def test_market_data_replays_stored_candles(tmp_path):
+    store = CsvStore(str(tmp_path))
+    frames = {
+        "BTCUSDT": make_klines(rows=50, seed=1),
+        "ETHUSDT": make_klines(rows=40, seed=2, start="2024-01-01 05:00"),
+    }
+    for symbol, kl in frames.items():
+        store.save(symbol, "1h", kl)
+    source = ReplayKlineSource(store, list(frames), "1h")
+    market = MarketData(list(frames), "1h", source, maxlen=30)
+
+    market.start()
+    assert market.finished.wait(10)
+    closes = market.wait_for_closes(timeout=0)
+
+    assert len(closes) == 90
+    times = [(candle.time, symbol) for symbol, candle in closes]
+    assert times == sorted(times)
+    for symbol in frames:
+        kl = store.load(symbol, "1h")
+        buffered = market.buffers[symbol].to_frame()
+        assert len(buffered) == 30
+        assert (buffered.index == kl.index[-30:]).all()
+        assert (buffered.Close.to_numpy() == kl.Close.to_numpy()[-30:]).all()
+
+
+class FakeConnection:
+    def __init__(self, payloads):
+        self.payloads = payloads
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.payloads:
+            # Stays open like a quiet stream
+            await asyncio.Event().wait()
+        return self.payloads.pop(0)
+
+
+async def no_wait(delay):
+    pass
+
+
+async def first_messages(source, count):
+    messages = []
+    async for message in source.messages():
+        messages.append(message)
+        if len(messages) == count:
+            return messages
+
+
+def test_kline_source_retries_failed_handshakes(monkeypatch):
+    row = next(make_klines(rows=1).itertuples())
+    payload = json.dumps(kline_message("BTCUSDT", "1h", row))
+    attempts = [
+        websockets.InvalidStatus(Response(503, "Service Unavailable", Headers())),
+        websockets.InvalidHandshake("bad handshake"),
+        FakeConnection([payload]),
+    ]
+
+    def connect(url, **kwargs):
+        attempt = attempts.pop(0)
+        if isinstance(attempt, Exception):
+            raise attempt
+        return attempt
+
+    monkeypatch.setattr(market_data.websockets, "connect", connect)
+    monkeypatch.setattr(market_data.asyncio, "sleep", no_wait)
+    source = BinanceKlineSource(["BTCUSDT"], "1h")
+
+    messages = asyncio.run(asyncio.wait_for(first_messages(source, 1), 5))
+    assert messages == [json.loads(payload)]
+    assert attempts == []
+
+
+def test_kline_source_failure_finishes_market_data(monkeypatch):
+    def connect(url, **kwargs):
+        raise ValueError("unexpected")
+
+    monkeypatch.setattr(market_data.websockets, "connect", connect)
+    market = MarketData(["BTCUSDT"], "1h", BinanceKlineSource(["BTCUSDT"], "1h"))
+
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(market.run(), 5))
+    assert market.finished.is_set()
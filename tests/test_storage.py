@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from klines import make_klines
+from storage import CsvStore, NpyStore
+
+
+def test_npy_store_migrates_csv_on_first_use(tmp_path):
+    kl = make_klines(rows=200)
+    CsvStore(str(tmp_path)).save("BTCUSDT", "1h", kl.iloc[:150])
+    store = NpyStore(str(tmp_path))
+
+    assert store.exists("BTCUSDT", "1h")
+    assert store.length("BTCUSDT", "1h") == 150
+    # Appending keeps the migrated history instead of starting a new store
+    store.append("BTCUSDT", "1h", kl.iloc[150:])
+    pd.testing.assert_frame_equal(
+        store.load("BTCUSDT", "1h"), kl, check_freq=False, check_exact=False
+    )
+
+
+def test_npy_store_without_csv(tmp_path):
+    store = NpyStore(str(tmp_path))
+    assert not store.exists("BTCUSDT", "1h")
+    assert not (tmp_path / "BTCUSDT-1h").exists()
+
+
+def test_store_klines_with_state_but_no_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "DATA_PATH", str(tmp_path))
+    # A state file left over from a store that was removed
+    kl = make_klines(rows=300)
+    utils.save_indicator_state("BTCUSDT", "1h", {"time": int(kl.index[-1].value)})
+    store = NpyStore(str(tmp_path))
+
+    assert utils.store_klines(store, "BTCUSDT", "1h", kl) == 300
+    assert store.length("BTCUSDT", "1h") == 300
+
+
+@pytest.mark.parametrize("kind", [CsvStore, NpyStore])
+def test_store_klines_batches_match_full_recompute(tmp_path, monkeypatch, kind):
+    monkeypatch.setattr(utils, "DATA_PATH", str(tmp_path))
+    updates = []
+    update_indicators = utils.update_indicators
+
+    def counted(*args):
+        updates.append(len(args[1]))
+        return update_indicators(*args)
+
+    monkeypatch.setattr(utils, "update_indicators", counted)
+    kl = make_klines(rows=1000)
+    store = kind(str(tmp_path))
+    bounds = [0, 400, 401, 408, 500, 750, 1000]
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        assert utils.store_klines(store, "BTCUSDT", "1h", kl.iloc[a:b].copy()) == b - a
+    # Everything after the first batch went through the incremental path
+    assert updates == [1, 7, 92, 250, 250]
+
+    expected = kl.copy()
+    utils.add_indicators(expected, dropna=False)
+    stored = store.load("BTCUSDT", "1h")
+    assert list(stored.index) == list(expected.index)
+    for name in expected.columns:
+        np.testing.assert_allclose(
+            stored[name].to_numpy(),
+            expected[name].to_numpy(),
+            rtol=1e-9,
+            atol=1e-9,
+            err_msg=name,
+        )
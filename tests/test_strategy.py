@@ -0,0 +1,24 @@
+from klines import make_klines
+from strategy import Strategy
+from utils import WF_OVERBOUGHT_GRID, WF_OVERSOLD_GRID, add_indicators
+
+
+def test_thresholds_on_the_stoch_rsi_scale():
+    strategy = Strategy()
+    # stoch_rsi goes from 0 to 1, the walk-forward grids too
+    assert min(WF_OVERSOLD_GRID) <= strategy.oversold <= max(WF_OVERSOLD_GRID)
+    assert min(WF_OVERBOUGHT_GRID) <= strategy.overbought <= max(WF_OVERBOUGHT_GRID)
+    values = {"Close": 10.0, "ema_200": 9.0}
+    assert strategy.evaluate({**values, "stoch_rsi": 0.5}) == "hold"
+    assert strategy.evaluate({**values, "stoch_rsi": 0.1}) == "buy"
+
+
+def test_signals_need_an_extreme_stoch_rsi():
+    kl = make_klines(rows=1000)
+    add_indicators(kl, dropna=False)
+    signals, _ = Strategy().get_signals(kl)
+    above_ema = (kl.ema_200 < kl.Close).to_numpy()
+    buy = signals == "buy"
+    assert buy.any()
+    assert buy.sum() < above_ema.sum()
+    assert (kl.stoch_rsi[buy] <= 0.2).all()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+from indicators import INDICATOR_COLUMNS, LOOKBACK, indicator_state
+from streaming import IndicatorStream
+from utils import add_indicators
+from klines import make_klines
+
+# Rows stored before the stream is seeded from the saved state
+SEEDED = 400
+
+
+@pytest.fixture(scope="module")
+def expected():
+    # The ta based batch computation the stream has to reproduce
+    kl = make_klines()
+    add_indicators(kl, dropna=False)
+    return kl
+
+
+def ta_indicators(kl):
+    # The ta calls add_indicators used to make, column by column
+    ta = pytest.importorskip("ta")
+    macd = ta.trend.MACD(kl.Close, window_fast=12, window_slow=26, window_sign=9)
+    stoch_rsi = ta.momentum.StochRSIIndicator(kl.Close, window=14)
+    bollinger = ta.volatility.BollingerBands(kl.Close, window=20, window_dev=2)
+    adx = ta.trend.ADXIndicator(kl.High, kl.Low, kl.Close, window=14)
+    return pd.DataFrame(
+        {
+            "macd": macd.macd(),
+            "macd_diff": macd.macd_diff(),
+            "macd_signal": macd.macd_signal(),
+            "rsi": ta.momentum.rsi(kl.Close, window=14),
+            "stoch_rsi": stoch_rsi.stochrsi(),
+            "stoch_rsi_k": stoch_rsi.stochrsi_k(),
+            "stoch_rsi_d": stoch_rsi.stochrsi_d(),
+            "bb_upper": bollinger.bollinger_hband(),
+            "bb_lower": bollinger.bollinger_lband(),
+            "bb_mid": bollinger.bollinger_mavg(),
+            "ema_200": ta.trend.ema_indicator(kl.Close, window=200),
+            "adx": adx.adx(),
+        },
+        index=kl.index,
+    )
+
+
+def stream_rows(stream, kl):
+    return pd.DataFrame(
+        [stream.update(*row) for row in zip(kl.index, kl.High, kl.Low, kl.Close)],
+        index=kl.index,
+    )
+
+
+def assert_matches(streamed, expected, columns):
+    for name in columns:
+        got = streamed[name].to_numpy(dtype=np.float64)
+        want = expected[name].to_numpy(dtype=np.float64)
+        # Same warmup rows without a value, same values after them
+        np.testing.assert_array_equal(np.isnan(got), np.isnan(want), err_msg=name)
+        np.testing.assert_allclose(
+            got, want, rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=name
+        )
+
+
+def test_add_indicators_matches_ta(expected):
+    assert_matches(expected, ta_indicators(make_klines()), INDICATOR_COLUMNS)
+
+
+def test_from_history_matches_add_indicators(expected):
+    stream = IndicatorStream()
+    streamed = stream_rows(stream, expected)
+    assert_matches(streamed, expected, INDICATOR_COLUMNS)
+
+
+def test_from_history_then_updates(expected):
+    stream = IndicatorStream.from_history(expected.iloc[:SEEDED])
+    streamed = stream_rows(stream, expected.iloc[SEEDED:])
+    assert_matches(streamed, expected.iloc[SEEDED:], INDICATOR_COLUMNS)
+
+
+def test_from_state_updates_match_add_indicators(expected):
+    stored = expected.iloc[:SEEDED]
+    stream = IndicatorStream.from_state(
+        stored.iloc[-LOOKBACK:], indicator_state(stored)
+    )
+    streamed = stream_rows(stream, expected.iloc[SEEDED:])
+    assert_matches(streamed, expected.iloc[SEEDED:], INDICATOR_COLUMNS)
+
+
+def test_subset_of_columns(expected):
+    columns = ["stoch_rsi", "ema_200"]
+    stored = expected.iloc[:SEEDED]
+    stream = IndicatorStream.from_state(
+        stored.iloc[-LOOKBACK:], indicator_state(stored), columns
+    )
+    streamed = stream_rows(stream, expected.iloc[SEEDED:])
+    # Only the requested groups are kept (the RSI comes with the Stoch RSI)
+    assert "macd" not in streamed and "adx" not in streamed
+    assert_matches(streamed, expected.iloc[SEEDED:], columns)
@@ -1,8 +1,20 @@
-import ta
 import os
 import json
+import numpy as np
 import pandas as pd
-from binance.client import Client
+from binance_integration import Binance
+from rate_limit import PRIORITY_MARKET
+from storage import get_store
+from resample import ResampledStore
+from results import read_results
+from indicators import (
+    INDICATOR_COLUMNS,
+    LOOKBACK,
+    MIN_HISTORY,
+    IndicatorFrame,
+    indicator_state,
+    update_indicators,
+)
 
 SYMBOLS = [
     "BTCUSDT",
@@ -14,97 +26,87 @@ SL = 0.02
 LEVERAGE = 10
 BALANCE = 300
 RISK_BALANCE = 0.3
+TP_GRID = [0.01, 0.02, 0.03, 0.05, 0.08]
+SL_GRID = [0.01, 0.02, 0.03]
+LEVERAGE_GRID = [5, 10, 20]
+RISK_BALANCE_GRID = [0.1, 0.2, 0.3]
+WORKERS = os.cpu_count()
+WF_TRAIN_BARS = 3000  # in-sample candles per walk-forward fold
+WF_TEST_BARS = 1000  # out-of-sample candles, also the step between folds
+# Stoch RSI thresholds tried in-sample, on the 0..1 scale of stoch_rsi
+WF_OVERSOLD_GRID = [0.1, 0.2, 0.3]
+WF_OVERBOUGHT_GRID = [0.7, 0.8, 0.9]
+WF_OBJECTIVE = "roi"  # metric maximized in-sample
+MC_RUNS = 10000  # Monte Carlo paths per backtest
+MC_SWEEP_RUNS = 1000  # per sweep combination
+MC_RUIN = 0.5  # share of the balance lost that counts as ruin
+DATA_PATH = "data"
+STORAGE = "npy"  # "csv" or "npy", see storage.py
+# e.g. "1m": store only these candles and build TIMEFRAME (or any other) from
+# them on load, see resample.py; None stores each timeframe on its own
+BASE_TIMEFRAME = None
+INTRABAR_EXITS = True  # TP/SL against candle High/Low, False for Close only
+# Stored candles read when one candle reaches both TP and SL, see exits.py
+INTRABAR_TIMEFRAME = "1m"
+BATCH_ORDERS = True  # entry, SL and TP in one batchOrders request
+PRICE_MAX_AGE = 5  # seconds a price snapshot is reused
+STRATEGY = "stoch_rsi_ema"  # see strategy.STRATEGIES
+# Passed to the strategy, e.g. the walk-forward's chosen thresholds:
+# {"oversold": 0.2, "overbought": 0.8} (Stoch RSI on the 0..1 scale)
+STRATEGY_PARAMS = {}
+RESULTS_JSON = False  # also export each backtest result as JSON
+INDICATOR_CACHE_BYTES = 512 * 2 ** 20  # data/.indicators size limit
+DASHBOARD_CACHE_SIZE = 32  # symbols kept in memory by app.py
+CHART_POINTS = 2000  # candles drawn per dashboard chart after downsampling
+TRADES_PAGE_SIZE = 25  # rows per page of the dashboard trades table
+DOWNLOAD_TIMEFRAMES = [BASE_TIMEFRAME or TIMEFRAME]
+DOWNLOAD_START = "2020-01-01"
+DOWNLOAD_CONCURRENCY = 10
 API_SECRET = os.environ.get("API_SECRET")
 API_KEY = os.environ.get("API_KEY")
 
 
+def kline_store():
+    store = get_store(STORAGE, DATA_PATH)
+    if BASE_TIMEFRAME is not None:
+        return ResampledStore(store, BASE_TIMEFRAME)
+    return store
+
+
+def backtest_results_file(symbol):
+    return f"results/backtest_results_{symbol}.btr"
+
+
+def backtest_results_json_file(symbol):
+    return f"results/backtest_results_{symbol}.json"
+
+
+def portfolio_results_file():
+    return "results/backtest_results_portfolio.btr"
+
+
+def portfolio_equity_file():
+    return "results/portfolio_equity.btr"
+
+
 def load_backtest_results(symbol):
-    with open(f"results/backtest_results_{symbol}.json", "r") as f:
-        result = json.load(f)
-        result["symbol"] = symbol
-        return result
-
-
-def add_indicators(data):
-
-    # Skip indicators if they already exist in the data
-    # if not "tenkan_sen" in data.columns:
-
-    #     ichi = ta.trend.IchimokuIndicator(high=data.High, low=data.Low)
-    #     data["tenkan_sen"] = ichi.ichimoku_base_line()
-    #     data["kijun_sen"] = ichi.ichimoku_conversion_line()
-    #     data["senkou_span_a"] = ichi.ichimoku_a()
-    #     data["senkou_span_b"] = ichi.ichimoku_b()
-
-    # data["rsi"] = ta.momentum.rsi(data.Close, window=14)
-    # MACD
-    macd = ta.trend.MACD(data.Close, window_fast=12,
-                         window_slow=26, window_sign=9)
-    data["macd"] = macd.macd()
-    data["macd_diff"] = macd.macd_diff()
-    data["macd_signal"] = macd.macd_signal()
-
-    # RSI
-    data["rsi"] = ta.momentum.rsi(data.Close, window=14)
-
-    # Stoch RSI
-    stoch_rsi = ta.momentum.StochRSIIndicator(data.Close, window=14)
-    data["stoch_rsi"] = stoch_rsi.stochrsi()
-    data["stoch_rsi_k"] = stoch_rsi.stochrsi_k()
-    data["stoch_rsi_d"] = stoch_rsi.stochrsi_d()
-
-    # Bandas de Bollinger
-    indicator_bb = ta.volatility.BollingerBands(
-        data.Close, window=20, window_dev=2)
-    data["bb_upper"] = indicator_bb.bollinger_hband()
-    data["bb_lower"] = indicator_bb.bollinger_lband()
-    data["bb_mid"] = indicator_bb.bollinger_mavg()
-
-    # # medias móviles exponenciales (EMA)
-    # data["ema_8"] = ta.trend.ema_indicator(data.Close, window=8)
-    # data["ema_20"] = ta.trend.ema_indicator(data.Close, window=20)
-    # data["ema_50"] = ta.trend.ema_indicator(data.Close, window=50)
-    # data["ema_100"] = ta.trend.ema_indicator(data.Close, window=100)
-    data["ema_200"] = ta.trend.ema_indicator(data.Close, window=200)
-
-    # ADX
-    adx = ta.trend.ADXIndicator(data.High, data.Low, data.Close, window=14)
-    data["adx"] = adx.adx()
-
-    # Average true range
-    # atr = ta.volatility.AverageTrueRange(data.High, data.Low, data.Close, window=14)
-    # data["atr"] = atr.average_true_range()
-
-    # Keltner Channel
-    # keltner = ta.volatility.KeltnerChannel(
-    #     data.High, data.Low, data.Close, window=20, window_atr=10
-    # )
-    # data["keltner_upper"] = keltner.keltner_channel_hband()
-    # data["keltner_lower"] = keltner.keltner_channel_lband()
-
-    # KST Indicator
-    # kst = ta.trend.KSTIndicator(
-    #     data.Close,
-    #     roc1=10,
-    #     roc2=15,
-    #     roc3=20,
-    #     roc4=30,
-    #     window1=10,
-    #     window2=10,
-    #     window3=10,
-    #     window4=15,
-    #     nsig=9,
-    # )
-    # data["kst"] = kst.kst()
-    # data["kst_diff"] = kst.kst_diff()
-    # data["kst_sig"] = kst.kst_sig()
-
-    # # ROC
-    # roc = ta.momentum.ROCIndicator(data.Close, window=12)
-    # data["roc"] = roc.roc()
+    # Trades come back as memory-mapped columns (see results.py)
+    result = read_results(backtest_results_file(symbol))
+    result["symbol"] = symbol
+    return result
+
+
+def add_indicators(data, dropna=True, columns=INDICATOR_COLUMNS, params=None):
+    # Adds `columns` (all the stored indicators by default) through the
+    # indicator registry; only what is asked for is computed, and shared
+    # intermediates (the RSI behind the Stoch RSI) only once
+    frame = IndicatorFrame(data, params)
+    for name in columns:
+        data[name] = frame[name]
 
     # Remove rows with null values in any column
-    data.dropna(inplace=True)
+    if dropna:
+        data.dropna(inplace=True)
 
 
 def calculate_pnl_short(last_close, entry_price, lended_qty):
@@ -118,6 +120,17 @@ def calculate_pnl_long(last_close, entry_price, lended_qty):
 
 
 def calculate_position_pnl(position, last_close):
+    if isinstance(position["sign"], np.ndarray):
+        # Columnar positions (arrays per field): one pnl per position
+        return np.where(
+            position["sign"] == "buy",
+            calculate_pnl_long(
+                last_close, position["entry_price"], position["lended_qty"]
+            ),
+            calculate_pnl_short(
+                last_close, position["entry_price"], position["lended_qty"]
+            ),
+        )
     if position["sign"] == "buy":
         return calculate_pnl_long(
             last_close, position["entry_price"], position["lended_qty"]
@@ -128,47 +141,116 @@ def calculate_position_pnl(position, last_close):
         )
 
 
+def indicator_state_file(symbol, timeframe):
+    return os.path.join(DATA_PATH, f"{symbol}-{timeframe}.state.json")
+
+
+def load_indicator_state(symbol, timeframe):
+    try:
+        with open(indicator_state_file(symbol, timeframe), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_indicator_state(symbol, timeframe, state):
+    with open(indicator_state_file(symbol, timeframe), "w") as f:
+        json.dump(state, f)
+
+
+def klines_to_frame(klines, closed_before=None):
+    data = []
+    for kline in klines:
+        # Skip the candle that is still open, it would be stored half built
+        if closed_before is not None and kline[6] >= closed_before:
+            continue
+        timestamp = pd.Timestamp(kline[0] / 1000, unit="s")
+        open_price = float(kline[1])
+        high_price = float(kline[2])
+        low_price = float(kline[3])
+        close_price = float(kline[4])
+        volume = float(kline[5])
+        data.append(
+            [timestamp, open_price, high_price, low_price, close_price, volume]
+        )
+
+    df = pd.DataFrame(
+        data, columns=["Time", "Open", "High", "Low", "Close", "Volume"]
+    )
+    return df.set_index("Time")
+
+
+def store_klines(store, symbol, timeframe, df):
+    # Adds OHLCV rows that come after the stored ones, with their indicators
+    exists = store.exists(symbol, timeframe)
+    history = store.load(symbol, timeframe, tail=LOOKBACK) if exists else None
+    if exists and len(history) > 0:
+        df = df[df.index > history.index[-1]]
+    added = len(df)
+    if added == 0:
+        return 0
+    if isinstance(store, ResampledStore):
+        # Base candles are kept as plain OHLCV, indicators are computed on
+        # the resampled frames (indicator_cache.py)
+        store.append(symbol, timeframe, df)
+        return added
+
+    state = load_indicator_state(symbol, timeframe)
+    incremental = (
+        state is not None
+        and exists
+        and len(history) > 0
+        and state["time"] == history.index[-1].value
+        and len(store.load(symbol, timeframe, columns=["Close"])) >= MIN_HISTORY
+    )
+    if incremental:
+        # Only the new candles are computed and appended
+        rows, state = update_indicators(history, df, state)
+        store.append(symbol, timeframe, rows[history.columns])
+    else:
+        # Full recompute over the raw history, warmup rows are kept so the
+        # next run can continue from the saved state
+        if exists:
+            ohlcv = store.load(
+                symbol, timeframe, columns=["Open", "High", "Low", "Close", "Volume"]
+            )
+            df = pd.concat([ohlcv, df])
+            df = df[~df.index.duplicated(keep="last")]
+        add_indicators(df, dropna=False)
+        state = indicator_state(df)
+        store.save(symbol, timeframe, df)
+    save_indicator_state(symbol, timeframe, state)
+    return added
+
+
 def extract_data():
-    client = Client(API_KEY, API_SECRET)
+    # Same request scheduler as the live bot, so the pages of history are
+    # counted against the weight limit
+    session = Binance(API_KEY, API_SECRET)
+    store = kline_store()
+    # Only the base candles when the other timeframes are resampled
+    timeframe = BASE_TIMEFRAME or TIMEFRAME
     for symbol in SYMBOLS:
         print(f"Extracting data for {symbol}...")
-        try:
-            inital_df = pd.read_csv(f"data/{symbol}-{TIMEFRAME}.csv")
-        except FileNotFoundError:
-            inital_df = pd.DataFrame(
-                columns=["Time", "Open", "High", "Low", "Close", "Volume"]
-            )
-
-        inital_df["Time"] = pd.to_datetime(inital_df["Time"])
+        exists = store.exists(symbol, timeframe)
+        history = store.load(symbol, timeframe, tail=1) if exists else None
         start_date = (
-            inital_df["Time"].iloc[-1].strftime("%Y-%m-%d %H:%M:%S")
-            if len(inital_df) > 0
+            history.index[-1].strftime("%Y-%m-%d %H:%M:%S")
+            if exists and len(history) > 0
             else "2020-01-01 00:00:00"
         )
 
-        klines = client.futures_historical_klines(
+        klines = session.call(
+            "futures_historical_klines",
+            PRIORITY_MARKET,
             symbol=symbol,
-            interval=TIMEFRAME,
+            interval=timeframe,
             start_str=start_date,
             limit=1000,
         )
-
-        data = []
-        for kline in klines:
-            timestamp = pd.Timestamp(kline[0] / 1000, unit="s")
-            open_price = float(kline[1])
-            high_price = float(kline[2])
-            low_price = float(kline[3])
-            close_price = float(kline[4])
-            volume = float(kline[5])
-            data.append(
-                [timestamp, open_price, high_price, low_price, close_price, volume]
-            )
-
-        df = pd.DataFrame(
-            data, columns=["Time", "Open", "High", "Low", "Close", "Volume"]
-        )
-        df = pd.concat([inital_df, df], ignore_index=True)
-        add_indicators(df)
-        df.to_csv(f"data/{symbol}-{TIMEFRAME}.csv", index=False)
+        now = int(pd.Timestamp.now(tz="UTC").timestamp() * 1000)
+        df = klines_to_frame(klines, closed_before=now)
+        if store_klines(store, symbol, timeframe, df) == 0:
+            print("Already up to date")
+            continue
         print(f"Data extracted")
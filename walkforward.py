@@ -0,0 +1,232 @@
+import itertools
+import json
+import os
+import numpy as np
+import pandas as pd
+from backtest import (
+    START_ROW,
+    TRADE_COLUMNS,
+    encode_signals,
+    iso_dates,
+    run_backtest,
+    trades_to_records,
+)
+from metrics import Metrics
+from strategy import get_strategy
+from utils import STRATEGY
+from workers import shared, worker_pool
+
+# Rows without a signal at the start of the history, as in add_signals
+SIGNAL_WINDOW = 20
+
+
+def signal_sides(data, strategy, oversold, overbought):
+    # add_signals for one pair of thresholds, encoded for run_backtest
+    signals, _ = get_strategy(
+        strategy, oversold=oversold, overbought=overbought
+    ).get_signals(data)
+    side = np.concatenate(([0], encode_signals(signals)[:-1])).astype(np.int8)
+    side[:SIGNAL_WINDOW] = 0
+    return side
+
+
+def symbol_arrays(data, oversold_grid, overbought_grid, strategy=STRATEGY):
+    # Everything the folds read, computed once over the whole history
+    return {
+        "close": data.Close.to_numpy(dtype=np.float64),
+        "times": data.index.values.astype("datetime64[ns]").view(np.int64),
+        "sides": {
+            (oversold, overbought): signal_sides(
+                data, strategy, oversold, overbought
+            )
+            for oversold in oversold_grid
+            for overbought in overbought_grid
+        },
+    }
+
+
+def make_folds(length, train_bars, test_bars):
+    # Rolling (train_start, test_start, test_end) windows, stepping by the
+    # test size so the out-of-sample parts are back to back
+    return [
+        (start, start + train_bars, min(start + train_bars + test_bars, length))
+        for start in range(0, length - train_bars - START_ROW, test_bars)
+    ]
+
+
+def _backtest_slice(arrays, start, stop, params, balance, leverage, risk_balance):
+    tp, sl, oversold, overbought = params
+    return run_backtest(
+        arrays["close"][start:stop],
+        arrays["sides"][(oversold, overbought)][start:stop],
+        arrays["times"][start:stop],
+        tp,
+        sl,
+        balance,
+        leverage,
+        risk_balance,
+    )
+
+
+def _optimize_fold(
+    symbol, start, stop, combinations, balance, leverage, risk_balance, objective
+):
+    arrays = shared["arrays"][symbol]
+    runs = [
+        _backtest_slice(arrays, start, stop, params, balance, leverage, risk_balance)
+        for params in combinations
+    ]
+    results = Metrics().calculate_batch(
+        runs, arrays["close"][start:stop], arrays["times"][start:stop], balance
+    )
+    # Best objective, ties go to the higher profit factor and then to the
+    # first combination, like the sweep ranking
+    best = max(
+        range(len(results)),
+        key=lambda i: (results[i][objective], results[i]["profit_factor"], -i),
+    )
+    return combinations[best], results[best]
+
+
+def close_at_end(trades, balance, times):
+    # A trade still open when the test window ends is closed at the last
+    # candle, so the next fold starts flat from the realized balance
+    if len(trades["pnl"]) == 0 or not trades["open"][-1]:
+        return trades
+    trades = {name: values.copy() for name, values in trades.items()}
+    trades["exit_idx"][-1] = len(times) - 1
+    trades["exit_time"][-1] = times[-1]
+    trades["open"][-1] = False
+    trades["starting_balance"][-1] = balance + trades["pnl"][:-1].sum()
+    trades["final_balance"][-1] = trades["starting_balance"][-1] + trades["pnl"][-1]
+    return trades
+
+
+def _stitch(parts, offset):
+    # Fold trade tables into one, indices relative to the first OOS candle
+    columns = {name: [] for name in TRADE_COLUMNS}
+    for start, trades in parts:
+        for name in columns:
+            values = trades[name]
+            if name in ("entry_idx", "exit_idx"):
+                values = values + (start - offset)
+            columns[name].append(values)
+    return {
+        name: np.concatenate(values).astype(TRADE_COLUMNS[name])
+        for name, values in columns.items()
+    }
+
+
+def run_walkforward(
+    klines,
+    balance,
+    leverage,
+    risk_balance,
+    tp_grid,
+    sl_grid,
+    oversold_grid,
+    overbought_grid,
+    train_bars,
+    test_bars,
+    objective="roi",
+    workers=None,
+    strategy=STRATEGY,
+):
+    arrays = {
+        symbol: symbol_arrays(kl, oversold_grid, overbought_grid, strategy)
+        for symbol, kl in klines.items()
+    }
+    combinations = list(
+        itertools.product(tp_grid, sl_grid, oversold_grid, overbought_grid)
+    )
+    folds = {
+        symbol: make_folds(len(data["close"]), train_bars, test_bars)
+        for symbol, data in arrays.items()
+    }
+
+    # In-sample optimization of every fold of every symbol in parallel
+    with worker_pool(workers or os.cpu_count(), {"arrays": arrays}) as executor:
+        futures = {
+            (symbol, i): executor.submit(
+                _optimize_fold,
+                symbol,
+                train_start,
+                test_start,
+                combinations,
+                balance,
+                leverage,
+                risk_balance,
+                objective,
+            )
+            for symbol, symbol_folds in folds.items()
+            for i, (train_start, test_start, _) in enumerate(symbol_folds)
+        }
+        optimized = {key: future.result() for key, future in futures.items()}
+
+    # Out-of-sample runs are cheap and chained on the balance, so they run
+    # here in order
+    reports = dict()
+    metrics = Metrics()
+    for symbol, symbol_folds in folds.items():
+        data = arrays[symbol]
+        if not symbol_folds:
+            print(f"{symbol}: not enough candles for a walk-forward fold")
+            continue
+        oos_start = symbol_folds[0][1] - START_ROW
+        oos_end = symbol_folds[-1][2]
+        fold_balance = balance
+        parts = []
+        fold_reports = []
+        for i, (train_start, test_start, test_end) in enumerate(symbol_folds):
+            params, train_metrics = optimized[(symbol, i)]
+            start = test_start - START_ROW
+            trades = _backtest_slice(
+                data, start, test_end, params, fold_balance, leverage, risk_balance
+            )
+            trades = close_at_end(trades, fold_balance, data["times"][start:test_end])
+            test_metrics = metrics.calculate(
+                trades,
+                data["close"][start:test_end],
+                data["times"][start:test_end],
+                fold_balance,
+            )
+            parts.append((start, trades))
+            if len(trades["pnl"]):
+                fold_balance = float(trades["final_balance"][-1])
+
+            tp, sl, oversold, overbought = params
+            fold_reports.append(
+                {
+                    "train_start": str(pd.Timestamp(data["times"][train_start])),
+                    "test_start": str(pd.Timestamp(data["times"][test_start])),
+                    "test_end": str(pd.Timestamp(data["times"][test_end - 1])),
+                    "params": {
+                        "tp": tp,
+                        "sl": sl,
+                        "oversold": oversold,
+                        "overbought": overbought,
+                    },
+                    "train_metrics": train_metrics,
+                    "test_metrics": test_metrics,
+                }
+            )
+
+        trades = _stitch(parts, oos_start)
+        reports[symbol] = {
+            "metrics": metrics.calculate(
+                trades,
+                data["close"][oos_start:oos_end],
+                data["times"][oos_start:oos_end],
+                balance,
+            ),
+            "trades": trades_to_records(trades),
+            "folds": fold_reports,
+        }
+    return reports
+
+
+def write_walkforward_results(symbol, report, config):
+    iso_dates(report["trades"])
+    result = {**report, "config": {"symbol": symbol, **config}}
+    with open(f"results/walkforward_results_{symbol}.json", "w") as f:
+        json.dump(result, f, indent=4)
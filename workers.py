@@ -0,0 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# Read-only data of a process pool (symbol arrays, exit resolvers...), given
+# to each worker process once by the pool initializer instead of being
+# pickled with every task
+shared = dict()
+
+
+def _init_worker(data):
+    shared.clear()
+    shared.update(data)
+
+
+def worker_pool(workers, data):
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(data,)
+    )